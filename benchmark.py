@@ -0,0 +1,299 @@
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+from languages import LANGUAGES, language_for_code
+
+# common words without any sensitive terms, the texts are made of these and of the terms of modified_data.json. 
+# Languages without filler words use their stopwords instead (see get_filler_words)
+FILLER_WORDS = {
+    "english": ("the a of and to in is was for that with as it by from this be are have has not "
+                "we you our people time year day work group report text article study city "
+                "country school government history language meeting question change example "
+                "new many other more important different public local social political long small large "
+                "said wrote explained described shows found asked believe discuss continue include").split(),
+    "german": ("der die das und zu in ist war für auf dass mit als es von bei dem den ein eine nicht "
+               "wir sie ihr unsere Zeit Jahr Tag Arbeit Gruppe Bericht Text Artikel Studie Stadt "
+               "Schule Regierung Gemeinschaft Geschichte Sprache Treffen Frage Wandel Beispiel "
+               "neue viele wichtige verschiedene öffentliche lokale soziale politische lange kleine große "
+               "sagte schrieb erklärte beschreibt zeigt fragte glauben diskutieren weiter").split(),
+}
+
+# stages of checking a text whose time is measured separately, see measure_stages
+STAGES = ("detect", "tokenize", "stem", "correct", "match", "db", "render", "total")
+
+
+def load_benchmark_terms(data_path="modified_data.json"):
+    """
+    Loads the terms that are inserted into the generated texts.
+
+    Parameters:
+    - data_path (str, optional): Path of the JSON file with the terms (see read_data.py). Defaults to 'modified_data.json'.
+
+    Returns:
+    - dict: The list of terms of each registered language by language (see languages.py).
+    """
+    with open(data_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    terms = {language: [] for language in LANGUAGES}
+    for item in data:
+        language = language_for_code(item['lemma_lang'])
+        if language in terms:
+            terms[language].append(item['lemma'])
+    return terms
+
+
+def get_filler_words(language, terms):
+    """
+    Returns the words the texts of the language are made of besides the terms.
+
+    Parameters:
+    - language (str): The language of the texts.
+    - terms (list): The terms of the language, words of the terms are never used as filler words.
+
+    Returns:
+    - list: The filler words of the language, or its stopwords (see LanguagePipeline) if it has none.
+    """
+    if language in FILLER_WORDS:
+        return FILLER_WORDS[language]
+    # stopwords can be sensitive terms themselves, these would be matched like the inserted terms
+    term_words = set(word.lower() for term in terms for word in term.split())
+    return sorted(word for word in LANGUAGES[language].stopwords if word.lower() not in term_words)
+
+
+def generate_text(terms, filler_words, length, density, rng):
+    """
+    Generates a text of sentences made of filler words with sensitive terms inserted at random.
+
+    Parameters:
+    - terms (list): The terms to insert.
+    - filler_words (list): The words the rest of the text is made of.
+    - length (int): The minimum number of characters of the text.
+    - density (float): The share of the words (or multi-word terms) that are terms, between 0 and 1.
+    - rng (random.Random): The random number generator, seeded for reproducible texts.
+
+    Returns:
+    - str: The generated text.
+    """
+    sentences = []
+    text_length = 0
+    while text_length < length:
+        words = []
+        for _ in range(rng.randint(6, 18)):
+            if terms and rng.random() < density:
+                words.append(rng.choice(terms))
+            else:
+                words.append(rng.choice(filler_words))
+            if rng.random() < 0.05:
+                words[-1] += ","
+        sentence = " ".join(words).rstrip(",")
+        sentence = sentence[0].upper() + sentence[1:] + rng.choice("....!?")
+        sentences.append(sentence)
+        text_length += len(sentence) + 1
+    return " ".join(sentences)
+
+
+def generate_corpus(terms, languages, lengths, densities, count, seed=0):
+    """
+    Generates the texts of the benchmark, the same texts for the same arguments.
+
+    Parameters:
+    - terms (dict): The terms of each language as returned by load_benchmark_terms.
+    - languages (iterable): The languages of the texts.
+    - lengths (iterable): The lengths of the texts in characters.
+    - densities (iterable): The shares of the words that are terms.
+    - count (int): The number of texts of each language, length and density.
+    - seed (int, optional): The seed of the random texts. Defaults to 0.
+
+    Returns:
+    - list: A dictionary with the 'language', 'length', 'density' and 'texts' for each combination.
+    """
+    corpus = []
+    for language in languages:
+        language_terms = terms.get(language, [])
+        filler_words = get_filler_words(language, language_terms)
+        if not filler_words:
+            print(f"Warning: skipping {language}, it has neither filler words nor stopwords to generate texts from")
+            continue
+        for length in lengths:
+            for density in densities:
+                rng = random.Random("{}-{}-{}-{}".format(seed, language, length, density))
+                texts = [generate_text(language_terms, filler_words, length, density, rng) for _ in range(count)]
+                corpus.append({"language": language, "length": length, "density": density, "texts": texts})
+    return corpus
+
+
+def measure_stages(text, language):
+    """
+    Checks the text like /submit and measures each stage. Requires an active Flask request context.
+
+    The stemmed words and the popups are cached as in a running app, so the stages are measured in their steady state,
+    except for the language detection and the loading of the alternatives ('db'), which are measured without their caches.
+    'render' includes loading how often the terms were marked as offensive, 'total' is the whole check with all caches.
+
+    Parameters:
+    - text (str): The text to check.
+    - language (str): The language of the text.
+
+    Returns:
+    - tuple: The seconds taken by each stage by stage name, and the numbers of words and of matched terms.
+    """
+    import textchecker
+    from language_detection import LanguageDetector
+    from term_details import load_alternatives, clear_alternatives
+
+    timings = {}
+    lexicon = textchecker.get_lexicon(language)
+
+    start = time.perf_counter()
+    LanguageDetector(cache_size=1).detect(text)
+    timings["detect"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    words, _ = textchecker.tokenize_with_spans(text, language)
+    timings["tokenize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stemmed_words = [lexicon.stemmer.stem(word.lower()) for word in words]
+    timings["stem"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    corrected_words = [lexicon.correct_spelling(word) for word in stemmed_words]
+    timings["correct"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matches = lexicon.find_matches(corrected_words)
+    timings["match"] = time.perf_counter() - start
+
+    matched_ids = set(term_id for _, _, term_id in matches)
+    clear_alternatives()
+    start = time.perf_counter()
+    if matched_ids:
+        load_alternatives(matched_ids)
+    timings["db"] = time.perf_counter() - start
+
+    indices, terms, split_text, spans = textchecker.find_sensitive_terms(text, language, return_spans=True)
+    start = time.perf_counter()
+    textchecker.create_marked_html(text, split_text, indices, terms, language, spans)
+    timings["render"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    textchecker.auto_detect_language(text)
+    indices, terms, split_text, spans = textchecker.find_sensitive_terms(text, language, return_spans=True)
+    textchecker.create_marked_html(text, split_text, indices, terms, language, spans)
+    timings["total"] = time.perf_counter() - start
+
+    return timings, len(words), len(matches)
+
+
+def measure_peak_memory(text, language):
+    """ Returns the peak number of bytes allocated while checking the text like /submit, measured with tracemalloc. """
+    import textchecker
+    tracemalloc.start()
+    try:
+        indices, terms, split_text, spans = textchecker.find_sensitive_terms(text, language, return_spans=True)
+        textchecker.create_marked_html(text, split_text, indices, terms, language, spans)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _summarize(values):
+    values = sorted(values)
+    return {"median": statistics.median(values), "min": values[0],
+            "p95": values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]}
+
+
+def run_benchmark(corpus, repeat=5):
+    """
+    Measures the stages of checking each text of the corpus. Requires an active Flask request context.
+
+    Parameters:
+    - corpus (list): The texts as returned by generate_corpus.
+    - repeat (int, optional): How many times each text is checked, the first check warms up the caches and is not counted. Defaults to 5.
+
+    Returns:
+    - dict: The 'meta' data of the run and the 'results' of each language, length and density, with the median, minimum and
+      95th percentile of the seconds per stage, the characters checked per second, the words, the matched terms and the
+      peak memory in bytes.
+    """
+    results = []
+    for group in corpus:
+        language = group["language"]
+        timings = {stage: [] for stage in STAGES}
+        words = matches = peak_memory = 0
+        for text in group["texts"]:
+            for round_number in range(repeat + 1):
+                text_timings, words_in_text, matches_in_text = measure_stages(text, language)
+                if round_number == 0:
+                    continue
+                for stage, seconds in text_timings.items():
+                    timings[stage].append(seconds)
+            words += words_in_text
+            matches += matches_in_text
+            peak_memory = max(peak_memory, measure_peak_memory(text, language))
+
+        stages = {stage: _summarize(values) for stage, values in timings.items()}
+        length = sum(len(text) for text in group["texts"]) / len(group["texts"])
+        results.append({"language": language, "length": group["length"], "density": group["density"],
+                        "texts": len(group["texts"]), "words": words // len(group["texts"]),
+                        "matches": matches // len(group["texts"]), "stages": stages,
+                        "chars_per_second": length / stages["total"]["median"] if stages["total"]["median"] else None,
+                        "peak_memory": peak_memory})
+
+    meta = {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "machine": platform.machine(), "repeat": repeat}
+    return {"meta": meta, "results": results}
+
+
+def _result_key(result):
+    return (result["language"], result["length"], result["density"])
+
+
+def compare_results(previous, current, threshold=0.1):
+    """
+    Compares the median seconds of each stage with a previous run.
+
+    Parameters:
+    - previous (dict): The results of the previous run as returned by run_benchmark.
+    - current (dict): The results of the current run.
+    - threshold (float, optional): The share by which a stage has to be slower to count as a regression. Defaults to 0.1.
+
+    Returns:
+    - tuple: The lines of the comparison, and the number of stages that became slower by more than the threshold.
+    """
+    previous_results = {_result_key(result): result for result in previous["results"]}
+    lines = ["{:<8} {:>7} {:>7} {:<9} {:>11} {:>11} {:>8}".format("language", "length", "density", "stage", "before ms", "after ms", "change")]
+    regressions = 0
+    for result in current["results"]:
+        before = previous_results.get(_result_key(result))
+        if before is None:
+            continue
+        for stage in STAGES:
+            if stage not in before["stages"]:
+                continue
+            old = before["stages"][stage]["median"]
+            new = result["stages"][stage]["median"]
+            change = (new - old) / old if old else 0.0
+            marker = ""
+            if change > threshold:
+                regressions += 1
+                marker = " slower"
+            lines.append("{:<8} {:>7} {:>7} {:<9} {:>11.3f} {:>11.3f} {:>+7.0%}{}".format(
+                result["language"], result["length"], result["density"], stage, old * 1000, new * 1000, change, marker))
+    return lines, regressions
+
+
+def format_results(results):
+    """ Returns the lines of a table with the median milliseconds of each stage and the peak memory of each text group. """
+    lines = ["{:<8} {:>7} {:>7} {:>6} {:>7} ".format("language", "length", "density", "words", "matches")
+             + " ".join("{:>8}".format(stage) for stage in STAGES) + " {:>9} {:>9}".format("chars/s", "peak KiB")]
+    for result in results["results"]:
+        lines.append("{:<8} {:>7} {:>7} {:>6} {:>7} ".format(result["language"], result["length"], result["density"],
+                                                            result["words"], result["matches"])
+                     + " ".join("{:>8.2f}".format(result["stages"][stage]["median"] * 1000) for stage in STAGES)
+                     + " {:>9.0f} {:>9.0f}".format(result["chars_per_second"] or 0, result["peak_memory"] / 1024))
+    return lines
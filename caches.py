@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# marks the modal ids in cached fragments so they can be moved to the ids of the current page
+MODAL_ID_MARKER = "\x00"
+
+
+def modal_id_placeholder(relative_id):
+    """ Returns the placeholder for the modal with the given id relative to the first modal of a fragment. """
+    return "{marker}{id}{marker}".format(marker=MODAL_ID_MARKER, id=relative_id)
+
+
+class RelocatableFragment(object):
+    """ Rendered HTML containing modal id placeholders that can be replaced by ids starting at any offset """
+
+    def __init__(self, html):
+        # split the html into alternating parts of text and relative modal ids
+        parts = html.split(MODAL_ID_MARKER)
+        self.texts = parts[0::2]
+        self.relative_ids = [int(relative_id) for relative_id in parts[1::2]]
+
+    def render(self, starting_modal_id):
+        """ Returns the HTML with the modal ids counted from the given starting id. """
+        html = [self.texts[0]]
+        for relative_id, text in zip(self.relative_ids, self.texts[1:]):
+            html.append(str(starting_modal_id + relative_id))
+            html.append(text)
+        return "".join(html)
+
+
+class LRUCache(object):
+    """ Bounded least recently used cache that counts its hits and misses """
+
+    def __init__(self, maxsize=1000):
+        """
+        Parameters:
+        - maxsize (int, optional): The maximum number of entries to keep, the least recently used ones are removed first. Defaults to 1000.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns the cached value for the key, or None if it is not cached. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._value(entry)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, value):
+        """ Adds a value to the cache, removing the least recently used values if the cache is full. """
+        self._put(key, value)
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _value(self, entry):
+        return entry
+
+    def discard(self, key):
+        """ Removes the value of the key from the cache if it is cached. """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Returns a dictionary with the size, hits and misses of the cache. """
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class FragmentCache(LRUCache):
+    """ Cache of rendered HTML fragments, which can be invalidated by the term ids they show """
+
+    def __init__(self, maxsize=1000):
+        super().__init__(maxsize)
+        # increased by every invalidation, fragments rendered from data loaded before an invalidation of one of their
+        # terms are not cached
+        self._generation = 0
+        self._invalidated = {}  # term id -> generation of its last invalidation
+        self._cleared = 0  # generation of the last time the cache was cleared
+
+    def generation(self):
+        """ Returns the current generation of the cache, which has to be taken before loading the data of a fragment (see put). """
+        with self._lock:
+            return self._generation
+
+    def put(self, key, value, term_ids=(), generation=None):
+        """
+        Adds a value to the cache, unless one of its terms was invalidated since the data of the fragment was loaded.
+
+        Parameters:
+        - key: The key of the fragment.
+        - value: The fragment to cache.
+        - term_ids (iterable, optional): The ids of all terms whose ratings are shown in the fragment.
+        - generation (int, optional): The generation of the cache before the data of the fragment was loaded (see generation).
+          The fragment is always cached if not given.
+
+        Returns:
+        - bool: Whether the fragment was cached.
+        """
+        term_ids = frozenset(term_ids)
+        with self._lock:
+            if generation is not None and (self._cleared > generation or 
+                                           any(self._invalidated.get(term_id, 0) > generation for term_id in term_ids)):
+                # the fragment may show ratings from before the invalidation
+                return False
+            self._entries[key] = (value, term_ids)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return True
+
+    def _value(self, entry):
+        return entry[0]
+
+    def invalidate(self, term_id):
+        """ Removes all fragments showing the term with the given id, e.g. after it was rated. """
+        with self._lock:
+            self._generation += 1
+            self._invalidated[term_id] = self._generation
+            for key in [key for key, (_, term_ids) in self._entries.items() if term_id in term_ids]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cleared = self._generation
+            self._entries.clear()
+
+
+class ResponseCache(object):
+    """
+    Cache of whole responses by the hash of everything they depend on. The cached responses are bounded by their total size and
+    expire after a while, they can also be stored as files in a directory shared by all processes and kept across restarts.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600, directory=None):
+        """
+        Parameters:
+        - max_bytes (int, optional): The maximum total length of the responses kept in memory, the least recently used ones are
+          removed first. Defaults to 64 MiB.
+        - ttl (float, optional): The number of seconds after which a cached response expires. Defaults to 3600.
+        - directory (str, optional): The directory in which responses are also stored, they are only kept in memory if not given.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (time it expires, response)
+        self._size = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        """ Returns the key of a response depending on the given JSON serializable parts, e.g. the text and the data versions. """
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """ Returns the cached response for the key, or None if it is not cached or expired. """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(key)
+
+        entry = self._read_file(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._add(key, entry)
+        return entry[1]
+
+    def put(self, key, response):
+        """ Adds a response (str) to the cache, removing the least recently used responses if the cache is full. """
+        # a single response must not push out most of the others
+        if len(response) > self.max_bytes // 4:
+            return
+        entry = (time.time() + self.ttl, response)
+        with self._lock:
+            self._add(key, entry)
+            self._writes += 1
+            remove_expired = self.directory and self._writes % 1000 == 0
+        if self.directory:
+            self._write_file(key, response)
+            if remove_expired:
+                self._remove_expired_files()
+
+    def _add(self, key, entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._size += len(entry[1])
+        while self._size > self.max_bytes:
+            _, (_, removed) = self._entries.popitem(last=False)
+            self._size -= len(removed)
+
+    def _remove(self, key):
+        _, response = self._entries.pop(key)
+        self._size -= len(response)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _read_file(self, key, now):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            expires = os.stat(path).st_mtime + self.ttl
+            if expires <= now:
+                return None
+            with open(path, encoding="utf-8") as f:
+                return (expires, f.read())
+        except OSError:
+            return None
+
+    def _write_file(self, key, response):
+        path = self._path(key)
+        # write to a temporary file first so other processes never read a partly written response
+        temporary_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                f.write(response)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            print(f"Error writing cached response {path}: {e}")
+
+    def _remove_expired_files(self):
+        oldest = time.time() - self.ttl
+        for directory, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    if os.stat(path).st_mtime < oldest:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """ Removes all responses kept in memory, the stored files expire by themselves. """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """ Returns a dictionary with the number and total length of the responses kept in memory, hits and misses of the cache. """
+        with self._lock:
+            return {"size": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,107 @@
+import json
+import os
+import sys
+from collections import deque
+from itertools import islice
+import multiprocessing
+
+
+def iter_documents(paths, language=None):
+    """
+    Reads the documents of the given files one at a time without loading the files into memory.
+
+    Files ending in .jsonl contain one document per line, either as a string or as an object with the 'text' and optionally
+    the 'language' and an 'id'. Every other file is read as one plain text document with the file path as id. Lines that 
+    are not valid JSON or no such document are skipped with a warning giving the file and line number.
+
+    Parameters:
+    - paths (iterable): Paths of the files to read.
+    - language (str, optional): The language of all documents, overrides the language of the documents if given.
+
+    Yields:
+    - dict: The document with its 'text', 'language' and 'id'.
+    """
+    for path in paths:
+        if path.endswith(".jsonl"):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line_number, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    location = "{}:{}".format(path, line_number)
+                    try:
+                        document = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        print("Warning: skipping {}, the line is not valid JSON: {}".format(location, e), file=sys.stderr)
+                        continue
+                    if isinstance(document, str):
+                        document = {"text": document}
+                    if not isinstance(document, dict) or not isinstance(document.get("text", ""), str):
+                        print("Warning: skipping {}, the line is neither a string nor an object with a 'text' string".format(location), file=sys.stderr)
+                        continue
+                    document.setdefault("id", location)
+                    if language:
+                        document["language"] = language
+                    yield document
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                yield {"id": path, "text": f.read(), "language": language or "auto"}
+
+
+def _init_worker():
+    # every worker gets its own application context and database connections, and builds the lexicons once
+    import textchecker
+    textchecker.app.app_context().push()
+    for engine in textchecker.db.engines.values():
+        engine.dispose(close=False)
+    textchecker.load_lexicons(textchecker.supported_languages)
+
+
+def _check_chunk(documents):
+    import textchecker
+    return textchecker.check_documents(documents)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def check_corpus(paths, output, workers=None, chunk_size=100, language=None):
+    """
+    Checks all documents of the given files for sensitive terms with a pool of worker processes and writes the result of
+    each document as one line of JSON (see check_documents) as soon as it is available, in the order of the documents.
+    Only a few chunks of documents per worker are held in memory at any time.
+
+    Parameters:
+    - paths (iterable): Paths of the files to check (see iter_documents).
+    - output (file): The file the results are written to.
+    - workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+    - chunk_size (int, optional): The number of documents sent to a worker at once. Defaults to 100.
+    - language (str, optional): The language of all documents, detected for each document if not given.
+
+    Returns:
+    - int: The number of documents that were checked.
+    """
+    workers = workers or os.cpu_count() or 1
+    checked = 0
+    with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        pending = deque()
+        for chunk in _chunks(iter_documents(paths, language), chunk_size):
+            pending.append(pool.apply_async(_check_chunk, (chunk,)))
+            # wait for the oldest chunk before reading more documents once every worker has enough work queued
+            if len(pending) >= 2 * workers:
+                checked += _write_results(pending.popleft().get(), output)
+        while pending:
+            checked += _write_results(pending.popleft().get(), output)
+    return checked
+
+
+def _write_results(results, output):
+    for result in results:
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+    output.flush()
+    return len(results)
@@ -0,0 +1,101 @@
+import hashlib
+import re
+import threading
+
+from caches import LRUCache
+from languages import LANGUAGES
+
+# texts in other languages detected by langdetect are treated as the default language
+DEFAULT_LANGUAGE = 'german'
+
+word_pattern = re.compile(r"\w+")
+
+# langdetect is imported and its profiles are loaded by one thread at a time, concurrent imports of its modules can fail
+_langdetect_lock = threading.Lock()
+
+
+class LanguageDetector(object):
+    """ Detects which of the supported languages a text is in, using a stopword heuristic before falling back to langdetect """
+
+    def __init__(self, sample_size=2000, cache_size=1000, min_stopwords=5, min_share=0.8, languages=None):
+        """
+        Parameters:
+        - sample_size (int, optional): Number of characters at the beginning of the text used for the detection. Defaults to 2000.
+        - cache_size (int, optional): Number of detected languages of recent texts to remember. Defaults to 1000.
+        - min_stopwords (int, optional): Minimum number of stopwords in the sample for the heuristic to decide. Defaults to 5.
+        - min_share (float, optional): Minimum share of the stopwords that have to belong to one language for the heuristic to decide. Defaults to 0.8.
+        - languages (list, optional): The names of the languages to detect (see languages.py). Defaults to all registered languages.
+        """
+        pipelines = [LANGUAGES[name] for name in (languages or LANGUAGES)]
+        # stopwords of each language, and languages by the langdetect language codes
+        self.stopwords = {pipeline.name: pipeline.stopwords for pipeline in pipelines}
+        self.language_codes = {pipeline.code: pipeline.name for pipeline in pipelines}
+        self.default_language = DEFAULT_LANGUAGE if DEFAULT_LANGUAGE in self.stopwords else pipelines[0].name
+        self.sample_size = sample_size
+        self.min_stopwords = min_stopwords
+        self.min_share = min_share
+        self.cache = LRUCache(cache_size)
+
+    def warm_up(self):
+        """ Loads the language profiles of langdetect, which otherwise happens when the first text is detected. """
+        _load_langdetect()
+
+    def sample(self, text):
+        """ Returns the beginning of the text used for the detection, without cutting off the last word. """
+        if len(text) <= self.sample_size:
+            return text
+        end = text.rfind(" ", 0, self.sample_size)
+        return text[:end if end > 0 else self.sample_size]
+
+    def detect(self, text):
+        """
+        Detects the language of the given text.
+
+        Parameters:
+        - text (str): The text for which the language needs to be detected.
+
+        Returns:
+        - str: The name of the detected language, or 'unknown' if the language could not be detected.
+        """
+        sample = self.sample(text)
+        key = hashlib.sha1(sample.encode("utf-8")).digest()
+        language = self.cache.get(key)
+        if language is None:
+            language = self.detect_by_stopwords(sample) or self.detect_by_langdetect(sample)
+            self.cache.put(key, language)
+        return language
+
+    def detect_by_stopwords(self, text):
+        """ Returns the language most stopwords of the text belong to, or None if there are too few stopwords to be sure. """
+        counts = dict.fromkeys(self.stopwords, 0)
+        for word in word_pattern.findall(text.lower()):
+            for language, stopwords in self.stopwords.items():
+                if word in stopwords:
+                    counts[language] += 1
+
+        total = sum(counts.values())
+        language = max(counts, key=counts.get)
+        if total >= self.min_stopwords and counts[language] >= self.min_share * total:
+            return language
+        return None
+
+    def detect_by_langdetect(self, text):
+        """ Returns the language detected by langdetect, the default language for other languages, or 'unknown' if it fails. """
+        # langdetect is only imported when it is needed, as importing it takes a while
+        detect = _load_langdetect()
+        try:
+            return self.language_codes.get(detect(text), self.default_language)
+        except Exception as e:
+            print(f"Error detecting language: {e}")
+            return 'unknown'
+
+
+def _load_langdetect():
+    # imports langdetect and loads its language profiles once, returns its detect function
+    with _langdetect_lock:
+        from langdetect import DetectorFactory, detect
+        from langdetect.detector_factory import init_factory
+        # make langdetect return the same language for the same text in every run
+        DetectorFactory.seed = 0
+        init_factory()
+    return detect
@@ -0,0 +1,82 @@
+class LanguagePipeline(object):
+    """ Everything needed to check texts of one language: how they are tokenized, stemmed and detected, and the texts of the UI """
+
+    def __init__(self, name, code, label, stopwords, stemmer_language=None, tokenizer_language=None, spelling_cutoff=0.8,
+                 term_languages=None, definition_key=None, strings=None):
+        """
+        Parameters:
+        - name (str): The name of the language used throughout the app, e.g. in requests and in the `language` column of the terms.
+        - code (str): The ISO 639-1 code of the language, as used by langdetect and in 'modified_data.json'.
+        - label (str): The name of the language shown on the page.
+        - stopwords (set): Frequent words that only appear in this language, used to detect the language of texts.
+        - stemmer_language (str, optional): The language of the Snowball stemmer. Defaults to the name.
+        - tokenizer_language (str, optional): The language of the punkt sentence tokenizer. Defaults to the name.
+        - spelling_cutoff (float, optional): The minimum similarity of a word to a word of the terms to be corrected to it. Defaults to 0.8.
+        - term_languages (list, optional): The languages of the terms that are matched in texts of this language. Defaults to only this language.
+        - definition_key (str, optional): The key of the definitions in this language in 'terms.json'.
+        - strings (dict, optional): The texts of the UI in this language by their key, see ENGLISH for the keys.
+        """
+        self.name = name
+        self.code = code
+        self.label = label
+        self.stopwords = frozenset(stopwords)
+        self.stemmer_language = stemmer_language or name
+        self.tokenizer_language = tokenizer_language or name
+        self.spelling_cutoff = spelling_cutoff
+        self.term_languages = tuple(term_languages or (name,))
+        self.definition_key = definition_key
+        self.strings = strings or {}
+
+
+ENGLISH = LanguagePipeline(
+    "english", "en", "English",
+    # frequent words that only appear in one of the languages, words used in both (e.g. "in", "was", "will") are left out
+    stopwords={"the", "and", "of", "to", "is", "are", "that", "this", "with", "for", "it", "not", "be", "have", "has",
+               "you", "we", "they", "he", "she", "from", "by", "on", "at", "or", "which", "were", "been", "their", "there",
+               "what", "would", "can", "could", "should", "as", "but", "if", "about", "more", "than", "who", "these"},
+    definition_key="langA",
+    strings={"alternative_heading": "Alternative terms"})
+
+GERMAN = LanguagePipeline(
+    "german", "de", "German",
+    stopwords={"der", "die", "das", "und", "ist", "sind", "nicht", "ein", "eine", "einen", "einem", "einer", "mit", "von",
+               "zu", "den", "dem", "des", "auf", "für", "sich", "auch", "es", "ich", "wir", "sie", "er", "wird", "werden",
+               "wurde", "dass", "oder", "aber", "wie", "bei", "nach", "noch", "nur", "über", "zum", "zur", "im", "ihr", "sein"},
+    definition_key="langB",
+    strings={"alternative_heading": "Alternative Begriffe"})
+
+# registered languages by name, in the order they are shown on the page
+LANGUAGES = {}
+
+
+def register_language(pipeline):
+    """ Adds the pipeline of a language to the registry, replacing a registered pipeline of the same name. """
+    LANGUAGES[pipeline.name] = pipeline
+
+
+def get_language(name):
+    """
+    Returns the pipeline of the language with the given name.
+
+    Parameters:
+    - name (str): The name of a registered language, e.g. 'english'.
+
+    Returns:
+    - LanguagePipeline: The pipeline of the language.
+
+    Raises:
+    - KeyError: If the language is not registered.
+    """
+    return LANGUAGES[name]
+
+
+def language_for_code(code):
+    """ Returns the name of the registered language with the given ISO 639-1 code, or None if there is none. """
+    for pipeline in LANGUAGES.values():
+        if pipeline.code == code:
+            return pipeline.name
+    return None
+
+
+register_language(ENGLISH)
+register_language(GERMAN)
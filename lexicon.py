@@ -0,0 +1,348 @@
+import heapq
+import threading
+from collections import Counter, namedtuple
+from difflib import SequenceMatcher
+from functools import lru_cache
+from sqlalchemy import event, select
+
+from models import Term, SyncWatcher, increase_sync_version, execute_read
+from stemming import get_stemmer
+from languages import get_language
+
+# compiled lexicons by language, rebuilt whenever the terms table version changes
+_lexicons = {}
+_lexicons_lock = threading.Lock()
+_terms_version = 0
+
+# notices when the terms were changed by any process
+_terms_watcher = SyncWatcher('terms', lambda: invalidate_lexicons())
+
+# immutable copy of the columns of a term, detached from the database session so it can be shared by all requests, 
+# threads and worker processes
+TermRecord = namedtuple("TermRecord", ["id", "term", "description", "language"])
+
+
+class SpellingIndex(object):
+    """ Index of the words of all terms to find the closest word for different spellings of a word """
+
+    def __init__(self, words, cutoff=0.8):
+        """
+        Parameters:
+        - words (list): The words of all terms, the original spelling is kept.
+        - cutoff (float, optional): The minimum similarity (as computed by difflib) a word needs to be considered close. Defaults to 0.8.
+        """
+        self.cutoff = cutoff
+        self.words = set(words)
+
+        # inverted index of the characters of the words by word length. A word with a character appearing n times is listed 
+        # under (character, 1) to (character, n), so the number of lists a word appears in for another word's characters
+        # is the number of characters the two words have in common
+        self.postings = {}
+        for word in self.words:
+            postings = self.postings.setdefault(len(word), {})
+            for char, count in Counter(word).items():
+                for occurrence in range(1, count+1):
+                    postings.setdefault((char, occurrence), []).append(word)
+
+    def _candidate_lengths(self, length):
+        # lengths of words for which the upper bound of the similarity (difflib's real_quick_ratio) reaches the cutoff
+        for other_length in self.postings:
+            total = length + other_length
+            if total and 2.0 * min(length, other_length) / total >= self.cutoff:
+                yield other_length
+
+    def _similar_words(self, word):
+        # yields (similarity, word) for the words of the index whose similarity to the given word reaches the cutoff
+        if not word:
+            # an empty word has no characters in common with any word, but difflib counts two empty words as equal
+            if word in self.words:
+                yield 1.0, word
+            return
+        # count the characters each word of a similar length has in common with the given word, this is the upper bound 
+        # of the similarity that difflib uses as quick_ratio
+        keys = [(char, occurrence) for char, count in Counter(word).items() for occurrence in range(1, count+1)]
+        common = Counter()
+        for length in self._candidate_lengths(len(word)):
+            postings = self.postings[length]
+            for key in keys:
+                common.update(postings.get(key, ()))
+
+        s = SequenceMatcher()
+        s.set_seq2(word)
+        for x, matches in common.items():
+            if 2.0 * matches / (len(word) + len(x)) < self.cutoff:
+                continue
+            s.set_seq1(x)
+            ratio = s.ratio()
+            if ratio >= self.cutoff:
+                yield ratio, x
+
+    def closest(self, word):
+        """
+        Returns the word of the index closest to the given word, which is the same word difflib.get_close_matches(word, words, n=1, cutoff=cutoff) returns.
+
+        Parameters:
+        - word (str): The word to find the closest word for.
+
+        Returns:
+        - str: The closest word, or None if no word is similar enough.
+        """
+        # the same word is always the best match
+        if word in self.words:
+            return word
+
+        # ties are broken the same way as by difflib, by the larger word
+        best = max(self._similar_words(word), default=None)
+        return best[1] if best is not None else None
+
+    def most_similar(self, word, n=10):
+        """
+        Returns the words of the index most similar to the given word, like difflib.get_close_matches(word, words, n, cutoff).
+
+        Parameters:
+        - word (str): The word to find similar words for.
+        - n (int, optional): The maximum number of words to return. Defaults to 10.
+
+        Returns:
+        - list: Tuples of (similarity, word) of the words that are similar enough, the most similar first.
+        """
+        return heapq.nlargest(n, self._similar_words(word))
+
+
+class Lexicon(object):
+    """ Sensitive terms of the database precompiled for matching in one language """
+
+    def __init__(self, language, terms, version=0):
+        """
+        Stems and orders the given terms once so they can be reused for every text that is checked.
+
+        Parameters:
+        - language (str): The language of the texts the lexicon is used for, one of the registered languages (see languages.py).
+        - terms (list): The records of the terms (see TermRecord).
+        - version (int, optional): The version of the terms table the lexicon was built from.
+        """
+        self.language = language
+        self.version = version
+        # the records of the matched terms are looked up here instead of loading them from the database
+        self.records = {term.id: term for term in terms}
+        pipeline = get_language(language)
+        # the stemmer remembers the stems of the words, which are reused when the lexicon is rebuilt and for the texts
+        stemmer = get_stemmer(pipeline.stemmer_language)
+
+        # sort the terms by their length (descending) to prioritize matching longer terms first
+        sorted_terms = sorted(terms, key=lambda t: len(t.term.split()), reverse=True)
+
+        self.term_ids = [term.id for term in sorted_terms]
+        self.term_id_set = frozenset(self.term_ids)
+        self.stemmed_terms = [" ".join([stemmer.stem(word) for word in term.term.split()]) for term in sorted_terms]
+        self.word_counts = [len(stemmed_term.split()) for stemmed_term in self.stemmed_terms]
+        self.max_words = max(self.word_counts, default=0)
+
+        # all single words of the terms, used to correct different spellings in the text
+        self.term_words = [word for term in sorted_terms for word in term.term.split(" ")]
+        self.spelling_index = SpellingIndex(self.term_words, pipeline.spelling_cutoff)
+        self.stemmer = stemmer
+        # real text repeats words heavily, so remember the corrections of words that were already seen
+        self.correct_spelling = lru_cache(maxsize=10000)(self._correct_spelling)
+
+        # token trie over the stemmed words of all terms. Each node is a tuple of the child nodes (by stemmed word)
+        # and the terms ending at the node (by their last stemmed word, as rank in the sorted terms)
+        self.trie = ({}, {})
+        for rank, stemmed_term in enumerate(self.stemmed_terms):
+            stems = stemmed_term.split()
+            if not stems:
+                print("empty stem term", self.term_ids[rank])
+                # if there is no stem we don't have to search for it, just move on to the next term
+                continue
+            node = self.trie
+            for stem in stems[:-1]:
+                node = node[0].setdefault(stem, ({}, {}))
+            node[1].setdefault(stems[-1], []).append(rank)
+
+    def _correct_spelling(self, stemmed_word):
+        """
+        Corrects a different spelling of a stemmed word of the text to the stem of the closest word of the terms.
+
+        Parameters:
+        - stemmed_word (str): The stemmed (and lowercased) word of the text.
+
+        Returns:
+        - str: The stem of the closest word of the terms, or the given word if no word of the terms is close to it.
+        """
+        close_match = self.spelling_index.closest(stemmed_word)
+        if close_match is None:
+            return stemmed_word
+        return self.stemmer.stem(close_match.lower())
+
+    def find_matches(self, stemmed_words):
+        """
+        Finds all non-overlapping occurrences of the terms in the stemmed words of a text in a single pass over the words.
+
+        A term matches if all but its last stemmed word are equal to consecutive words of the text and its last stemmed word 
+        is the beginning of the following word. Longer terms take precedence over shorter ones, terms with the same length keep 
+        the order of the database, and occurrences of the same term are taken from left to right. 
+
+        Parameters:
+        - stemmed_words (list): The stemmed (and lowercased) words of the text.
+
+        Returns:
+        - list: Tuples of (start word index, end word index, term id) of the matched terms, sorted by their start index.
+        """
+        return self.resolve_candidates(self.find_candidates(stemmed_words))
+
+    def find_candidates(self, stemmed_words):
+        """
+        Finds all occurrences of the terms in the stemmed words of a text, including overlapping ones (see find_matches).
+
+        Returns:
+        - list: Tuples of (rank of the term, start word index, end word index) of all occurrences.
+        """
+        # collect all candidate occurrences by walking the trie from every word of the text
+        candidates = []
+        for start in range(len(stemmed_words)):
+            children, endings = self.trie
+            for end in range(start, len(stemmed_words)):
+                word = stemmed_words[end]
+                if endings:
+                    for length in range(1, len(word)+1):
+                        for rank in endings.get(word[:length], ()):
+                            candidates.append((rank, start, end+1))
+                node = children.get(word)
+                if node is None:
+                    break
+                children, endings = node
+        return candidates
+
+    def resolve_candidates(self, candidates):
+        """
+        Selects the non-overlapping occurrences from the candidates returned by find_candidates (see find_matches).
+
+        Returns:
+        - list: Tuples of (start word index, end word index, term id) of the matched terms, sorted by their start index.
+        """
+        # resolve overlapping candidates in order of the term priority, then by position
+        candidates = sorted(candidates)
+        matched_terms_details = []
+        # marks the word indices in the text that are already covered by a match
+        covered = bytearray(max((end for _, _, end in candidates), default=0))
+        current_rank, next_start = -1, 0
+        for rank, start, end in candidates:
+            if rank != current_rank:
+                current_rank, next_start = rank, 0
+            # occurrences of the same term can't overlap each other
+            if start < next_start:
+                continue
+            next_start = end
+
+            # Append matched term details if it doesn't overlap with previously covered indices
+            if covered.find(1, start, end) == -1:
+                matched_terms_details.append((start, end, self.term_ids[rank]))
+                covered[start:end] = b"\x01" * (end - start)
+
+        # Sort matched terms by their starting index for proper ordering
+        matched_terms_details.sort(key=lambda x: x[0])
+        return matched_terms_details
+
+    @staticmethod
+    def last_independent_index(candidates, limit):
+        """
+        Finds the last word index up to which the matches of a text can be resolved independently of the words after it.
+        No candidate may start before and end after the index, then the candidates on either side can't affect each other.
+
+        Parameters:
+        - candidates (list): The candidates of the words as returned by find_candidates.
+        - limit (int): The largest index to consider, candidates of words after the limit may still be missing.
+
+        Returns:
+        - int: The index, or 0 if there is no such index.
+        """
+        crossed = bytearray(limit + 1)
+        for _, start, end in candidates:
+            for index in range(start + 1, min(end, limit + 1)):
+                crossed[index] = 1
+        for index in range(limit, 0, -1):
+            if not crossed[index]:
+                return index
+        return 0
+
+    def __len__(self):
+        return len(self.term_ids)
+
+
+def get_lexicon(language):
+    """
+    Returns the compiled lexicon for the given language, building it if the terms changed since it was last built.
+    Requires an active Flask application context.
+
+    Parameters:
+    - language (str): The language of the texts, one of the registered languages (see languages.py).
+
+    Returns:
+    - Lexicon: The lexicon of the terms matched in texts of the language (see LanguagePipeline.term_languages), stemmed for the language.
+    """
+    lexicon = _lexicons.get(language)
+    if lexicon is not None and lexicon.version == _terms_version:
+        return lexicon
+
+    with _lexicons_lock:
+        # another thread may have rebuilt the lexicon while we were waiting for the lock
+        lexicon = _lexicons.get(language)
+        version = _terms_version
+        if lexicon is None or lexicon.version != version:
+            # only the terms of the languages matched in texts of this language (see LanguagePipeline.term_languages)
+            rows = execute_read(select(Term.id, Term.term, Term.description, Term.language)
+                                .where(Term.language.in_(get_language(language).term_languages))).all()
+            lexicon = Lexicon(language, [TermRecord(*row) for row in rows], version)
+            _lexicons[language] = lexicon
+    return lexicon
+
+
+def load_lexicons(languages):
+    """ Builds the lexicons for all given languages, e.g. at startup so the first requests don't have to. """
+    for language in languages:
+        get_lexicon(language)
+
+
+def get_terms_version():
+    """ Returns the current version of the terms table, which changes whenever the lexicons are invalidated. """
+    return _terms_version
+
+
+def invalidate_lexicons(*args):
+    """
+    Marks all compiled lexicons as outdated so they are rebuilt from the database on their next use.
+    Has to be called whenever the terms table is modified without going through the Term model (e.g. bulk inserts).
+    """
+    global _terms_version
+    with _lexicons_lock:
+        _terms_version += 1
+
+
+def refresh_lexicons_if_synced(interval=5):
+    """
+    Invalidates the lexicons if the terms were changed by another process (e.g. by sync_data in read_data.py) since the last check.
+    The shared version in the database is checked at most once per interval. Requires an active Flask application context.
+
+    Parameters:
+    - interval (float, optional): Minimum number of seconds between two checks. Defaults to 5.
+
+    Returns:
+    - bool: Whether the lexicons were invalidated.
+    """
+    return _terms_watcher.check(interval)
+
+
+def get_synced_terms_version():
+    """ Returns the version of the terms shared by all processes that this process has picked up (see refresh_lexicons_if_synced). """
+    return _terms_watcher.version
+
+
+def _increase_synced_terms_version(mapper, connection, target):
+    # let the other processes know that a term was changed through the ORM
+    increase_sync_version('terms', connection)
+
+
+# rebuild the lexicons whenever a term is added, changed or removed through the ORM (e.g. by an admin)
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Term, _event_name, invalidate_lexicons)
+    event.listen(Term, _event_name, _increase_synced_terms_version)
@@ -0,0 +1,206 @@
+import cProfile
+import itertools
+import os
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds of the histogram buckets of durations (in seconds), sizes (in bytes) and counts
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 5000, 20000, 100000, 500000, 2000000, 10000000)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram(object):
+    """ Number of observed values per bucket, with their sum and count """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """ Counters and histograms of the application, which can be rendered in the text format of Prometheus """
+
+    def __init__(self):
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._descriptions = {}  # name -> (type, help text, buckets)
+        self._lock = threading.Lock()
+        # processes forked while another thread holds the lock get a new one (see parallel.py)
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text, buckets=TIME_BUCKETS):
+        """
+        Declares a metric.
+
+        Parameters:
+        - name (str): The name of the metric, counters end in '_total'.
+        - kind (str): 'counter', 'gauge' or 'histogram'.
+        - help_text (str): The description of the metric.
+        - buckets (tuple, optional): The upper bounds of the buckets of a histogram. Defaults to TIME_BUCKETS.
+        """
+        self._descriptions[name] = (kind, help_text, buckets)
+
+    def inc(self, name, amount=1, **labels):
+        """ Increases the counter with the given name and labels. """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """ Adds a value to the histogram with the given name and labels. """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._descriptions[name][2])
+            histogram.observe(value)
+
+    def timed(self, stage):
+        """ Decorator measuring the seconds each call of the function takes as the given stage of checking texts. """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe('textchecker_stage_seconds', time.perf_counter() - start, stage=stage)
+            return wrapper
+        return decorator
+
+    def render(self, samples=()):
+        """
+        Returns all metrics in the text format of Prometheus.
+
+        Parameters:
+        - samples (iterable, optional): Further (name, labels, value) tuples of declared counters and gauges, e.g. read from
+          the statistics of the caches when the metrics are requested.
+
+        Returns:
+        - str: The metrics, one sample per line.
+        """
+        values = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                values.setdefault(name, []).append((labels, value))
+            for (name, labels), histogram in self._histograms.items():
+                values.setdefault(name, []).append((labels, (list(histogram.counts), histogram.sum, histogram.count)))
+        for name, labels, value in samples:
+            values.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+
+        lines = []
+        for name in sorted(values):
+            kind, help_text, buckets = self._descriptions[name]
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, value in sorted(values[name], key=lambda sample: sample[0]):
+                if kind != 'histogram':
+                    lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append("{}_bucket{} {}".format(name, _format_labels(labels + (("le", _format_value(bound)),)), cumulative))
+                lines.append("{}_bucket{} {}".format(name, _format_labels(labels + (("le", "+Inf"),)), count))
+                lines.append("{}_sum{} {}".format(name, _format_labels(labels), _format_value(total)))
+                lines.append("{}_count{} {}".format(name, _format_labels(labels), count))
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = ('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def count_queries(metrics):
+    """
+    Counts and times the SQL statements executed by all engines, and counts them per request in `g.db_queries`.
+
+    Parameters:
+    - metrics (Metrics): The metrics to add the counts and durations of the queries to.
+    """
+    metrics.describe('textchecker_db_query_seconds', 'histogram', 'Seconds taken by SQL statements.')
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        start = connection.info['query_start'].pop()
+        metrics.observe('textchecker_db_query_seconds', time.perf_counter() - start)
+        if has_request_context():
+            g.db_queries = g.get('db_queries', 0) + 1
+
+
+class SampledProfiler(object):
+    """ Profiles a random sample of the requests with cProfile and writes the profiles to a directory """
+
+    def __init__(self, sample_rate=0.0, directory=None):
+        """
+        Parameters:
+        - sample_rate (float, optional): The share of the requests to profile, between 0 and 1. Defaults to 0 (no profiling).
+        - directory (str, optional): The directory the profiles are written to, required if the sample rate is above 0.
+        """
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.written = 0
+        self._numbers = itertools.count(1)
+        if sample_rate > 0:
+            os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        """ Starts profiling the current thread for a sampled request, returns the profile or None if the request is not sampled. """
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already active
+            return None
+        return profile
+
+    def stop(self, profile, name):
+        """ Stops the profile returned by start and writes it to a file named after the time, the name, the process and a counter. """
+        if profile is None:
+            return
+        profile.disable()
+        path = os.path.join(self.directory, "{}-{}-{}-{}.prof".format(time.strftime("%Y%m%d-%H%M%S"), name, os.getpid(), next(self._numbers)))
+        try:
+            profile.dump_stats(path)
+            self.written += 1
+        except OSError as e:
+            print(f"Error writing profile {path}: {e}")
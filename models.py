@@ -1,27 +1,70 @@
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, select, insert, event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# file locks are only available on Unix, elsewhere the setup of the database relies on retrying (see setup_database)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 db = SQLAlchemy()
 
 
 class AlternativeTerm(db.Model):
     __tablename__ = 'alternative_terms'
+    # the alternatives of the matched terms are loaded for every checked text
+    __table_args__ = (db.Index('ix_alternative_terms_original_term_id', 'original_term_id', 'alternative_term_id'),)
     id = db.Column(db.Integer, primary_key=True)
     original_term_id = db.Column(db.String(30), db.ForeignKey('terms.id'), nullable=False)
     alternative_term_id = db.Column(db.String(30), db.ForeignKey('terms.id'), nullable=False)
 
 class OffensivenessRating(db.Model):
     __tablename__ = 'offensiveness_ratings'
+    __table_args__ = (db.Index('ix_offensiveness_ratings_term_id', 'term_id'),)
     id = db.Column(db.Integer, primary_key=True)
     term_id = db.Column(db.String(30), db.ForeignKey('terms.id'), nullable=False)
     rating = db.Column(db.Integer)
 
 class AlternativeRating(db.Model):
     __tablename__ = 'appropriate_alternative_ratings'
+    __table_args__ = (db.Index('ix_appropriate_alternative_ratings_term_id', 'term_id', 'alternative_term_id'),)
     id = db.Column(db.Integer, primary_key=True)
     term_id = db.Column(db.String(30), db.ForeignKey('terms.id'), nullable=False)
     alternative_term_id = db.Column(db.String(30), db.ForeignKey('terms.id'), nullable=False)
     rating = db.Column(db.Integer)
 
+class OffensivenessCount(db.Model):
+    # number of offensiveness ratings per term, maintained together with the ratings
+    __tablename__ = 'offensiveness_counts'
+    term_id = db.Column(db.String(30), db.ForeignKey('terms.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class AlternativeRatingAggregate(db.Model):
+    # sum and number of the ratings per term and alternative, maintained together with the ratings
+    __tablename__ = 'alternative_rating_aggregates'
+    term_id = db.Column(db.String(30), db.ForeignKey('terms.id'), primary_key=True)
+    alternative_term_id = db.Column(db.String(30), db.ForeignKey('terms.id'), primary_key=True)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+
+class TermSource(db.Model):
+    # hash of the source record each term was last imported from, to detect changes of the source files
+    __tablename__ = 'term_sources'
+    term_id = db.Column(db.String(30), db.ForeignKey('terms.id'), primary_key=True)
+    source_hash = db.Column(db.String(64), nullable=False)
+
+class SyncState(db.Model):
+    # versions of data shared by all processes, e.g. increased whenever the terms are synced
+    __tablename__ = 'sync_state'
+    key = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 class Term(db.Model):
     __tablename__ = 'terms'
     id = db.Column(db.String(30), primary_key=True)
@@ -44,4 +87,259 @@ class Term(db.Model):
     offensiveness_ratings = db.relationship('OffensivenessRating', backref='term', lazy=True)
 
 
+def add_offensiveness_rating(term_id, rating=1):
+    """
+    Adds an offensiveness rating for the term and increases the offensiveness count of the term in the same transaction.
+    The changes are not committed.
+    """
+    db.session.add(OffensivenessRating(term_id=term_id, rating=rating))
+    increase_sync_version('ratings')
+    db.session.execute(sqlite_insert(OffensivenessCount)
+                       .values(term_id=term_id, count=1)
+                       .on_conflict_do_update(index_elements=['term_id'],
+                                              set_={'count': OffensivenessCount.count + 1}))
+
+def add_alternative_rating(term_id, alternative_term_id, rating):
+    """
+    Adds a rating of the alternative for the term and updates the rating sum and count of the pair in the same transaction.
+    The changes are not committed.
+    """
+    db.session.add(AlternativeRating(term_id=term_id, alternative_term_id=alternative_term_id, rating=rating))
+    increase_sync_version('ratings')
+    db.session.execute(sqlite_insert(AlternativeRatingAggregate)
+                       .values(term_id=term_id, alternative_term_id=alternative_term_id, rating_sum=rating, rating_count=1)
+                       .on_conflict_do_update(index_elements=['term_id', 'alternative_term_id'],
+                                              set_={'rating_sum': AlternativeRatingAggregate.rating_sum + rating,
+                                                    'rating_count': AlternativeRatingAggregate.rating_count + 1}))
+
+def add_offensiveness_ratings(term_ids, rating=1):
+    """
+    Adds an offensiveness rating for each of the given term ids (which may repeat) and increases the offensiveness counts 
+    of the terms in the same transaction, with one statement per table. The changes are not committed.
+    """
+    term_ids = list(term_ids)
+    if not term_ids:
+        return
+    db.session.execute(insert(OffensivenessRating), [{"term_id": term_id, "rating": rating} for term_id in term_ids])
+    increase_sync_version('ratings')
+
+    statement = sqlite_insert(OffensivenessCount)
+    statement = statement.on_conflict_do_update(index_elements=['term_id'],
+                                                set_={'count': OffensivenessCount.count + statement.excluded.count})
+    db.session.execute(statement, [{"term_id": term_id, "count": count} for term_id, count in Counter(term_ids).items()])
+
+def add_alternative_ratings(ratings):
+    """
+    Adds the given (term id, alternative term id, rating) tuples as ratings of the alternatives and updates the rating sums 
+    and counts of the pairs in the same transaction, with one statement per table. The changes are not committed.
+    """
+    ratings = list(ratings)
+    if not ratings:
+        return
+    db.session.execute(insert(AlternativeRating), [{"term_id": term_id, "alternative_term_id": alternative_term_id, "rating": rating}
+                                                   for term_id, alternative_term_id, rating in ratings])
+    increase_sync_version('ratings')
+
+    aggregates = {}
+    for term_id, alternative_term_id, rating in ratings:
+        rating_sum, rating_count = aggregates.get((term_id, alternative_term_id), (0, 0))
+        aggregates[(term_id, alternative_term_id)] = (rating_sum + rating, rating_count + 1)
+    statement = sqlite_insert(AlternativeRatingAggregate)
+    statement = statement.on_conflict_do_update(index_elements=['term_id', 'alternative_term_id'],
+                                                set_={'rating_sum': AlternativeRatingAggregate.rating_sum + statement.excluded.rating_sum,
+                                                      'rating_count': AlternativeRatingAggregate.rating_count + statement.excluded.rating_count})
+    db.session.execute(statement, [{"term_id": term_id, "alternative_term_id": alternative_term_id, "rating_sum": rating_sum, "rating_count": rating_count}
+                                   for (term_id, alternative_term_id), (rating_sum, rating_count) in aggregates.items()])
+
+def backfill_rating_aggregates():
+    """
+    Recomputes the offensiveness counts and alternative rating aggregates from all stored ratings and commits them.
+    Needed once for databases that contain ratings from before the aggregates were maintained.
+    """
+    db.session.execute(OffensivenessCount.__table__.delete())
+    db.session.execute(insert(OffensivenessCount).from_select(
+        ['term_id', 'count'],
+        select(OffensivenessRating.term_id, func.count(OffensivenessRating.id))
+        .group_by(OffensivenessRating.term_id)))
+
+    db.session.execute(AlternativeRatingAggregate.__table__.delete())
+    db.session.execute(insert(AlternativeRatingAggregate).from_select(
+        ['term_id', 'alternative_term_id', 'rating_sum', 'rating_count'],
+        select(AlternativeRating.term_id, AlternativeRating.alternative_term_id,
+               func.sum(AlternativeRating.rating), func.count(AlternativeRating.rating))
+        .where(AlternativeRating.rating.isnot(None))
+        .group_by(AlternativeRating.term_id, AlternativeRating.alternative_term_id)))
+    increase_sync_version('ratings')
+    db.session.commit()
+
+@contextmanager
+def setup_lock(path):
+    """
+    Holds an exclusive lock on the given file, so that only one process at a time sets up the database, e.g. when many 
+    workers of a WSGI server start at once. Without fcntl (e.g. on Windows) nothing is locked.
+
+    Parameters:
+    - path (str): The path of the lock file, which is created if it does not exist.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def ensure_indexes():
+    """
+    Creates the indexes of all tables that don't exist yet. db.create_all only creates the indexes of new tables, 
+    so this is needed for databases created before an index was added. Requires an active Flask application context.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def rating_aggregates_missing():
+    """ Returns True if there are ratings in the database but no aggregates of them, e.g. after an update of an existing database. """
+    has_ratings = db.session.execute(select(OffensivenessRating.id).limit(1)).first() is not None \
+        or db.session.execute(select(AlternativeRating.id).limit(1)).first() is not None
+    has_aggregates = db.session.execute(select(OffensivenessCount.term_id).limit(1)).first() is not None \
+        or db.session.execute(select(AlternativeRatingAggregate.term_id).limit(1)).first() is not None
+    return has_ratings and not has_aggregates
+
+def get_sync_version(key):
+    """
+    Returns the current version of the shared data with the given key (0 if it was never changed).
+    Uses its own connection so the version is not read from an older snapshot of the session's transaction.
+    """
+    with db.engine.connect() as connection:
+        version = connection.execute(select(SyncState.version).where(SyncState.key == key)).scalar()
+    return version or 0
+
+def increase_sync_version(key, connection=None):
+    """
+    Increases the version of the shared data with the given key in the current transaction of the session (or of the given
+    connection), the change is not committed. The versions written through the session are remembered until they are 
+    taken with pop_written_sync_versions, so the process can tell its own changes from those of other processes.
+
+    Returns:
+    - int: The new version.
+    """
+    version = (connection or db.session).execute(sqlite_insert(SyncState)
+                                                 .values(key=key, version=1)
+                                                 .on_conflict_do_update(index_elements=['key'], set_={'version': SyncState.version + 1})
+                                                 .returning(SyncState.version)).scalar()
+    if connection is None:
+        db.session.info.setdefault('sync_versions', []).append((key, version))
+    return version
+
+def pop_written_sync_versions(key):
+    """ Returns and forgets the versions of the data with the given key written through the session, to be called after the commit. """
+    written = db.session.info.get('sync_versions', [])
+    db.session.info['sync_versions'] = [(other_key, version) for other_key, version in written if other_key != key]
+    return [version for other_key, version in written if other_key == key]
+
+class SyncWatcher(object):
+    """ Notices when shared data was changed by any process, checking its version in the database at most once per interval """
+
+    def __init__(self, key, on_change=None):
+        """
+        Parameters:
+        - key (str): The key of the shared data in the `sync_state` table, e.g. 'terms' or 'ratings'.
+        - on_change (callable, optional): Called without arguments when a check notices that the version changed.
+        """
+        self.key = key
+        self.on_change = on_change
+        self.version = None  # version seen by the last check
+        self._acknowledged = set()  # versions written by this process that were not seen by a check yet
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def acknowledge(self, versions):
+        """
+        Remembers versions written and committed by this process (see pop_written_sync_versions), so that checks only 
+        count changes made by other processes and on_change is not called for changes this process already handled.
+        """
+        with self._lock:
+            self._acknowledged.update(versions)
+
+    def check(self, interval=5):
+        """
+        Checks whether the version of the data changed since the last check. The first check only remembers the version.
+        Requires an active Flask application context.
+
+        Parameters:
+        - interval (float, optional): Minimum number of seconds between two checks, earlier checks return False. Defaults to 5.
+
+        Returns:
+        - bool: Whether the version was changed by another process.
+        """
+        now = time.monotonic()
+        if now - self._last_check < interval:
+            return False
+        self._last_check = now
+
+        version = get_sync_version(self.key)
+        with self._lock:
+            changed = False
+            if self.version is not None and version != self.version:
+                # every change increases the version by one, so the version changed only by this process if all versions
+                # in between were acknowledged
+                own = sum(1 for acknowledged in self._acknowledged if self.version < acknowledged <= version)
+                changed = version < self.version or own < version - self.version
+            self._acknowledged = set(acknowledged for acknowledged in self._acknowledged if acknowledged > version)
+            self.version = version
+        if changed and self.on_change is not None:
+            self.on_change()
+        return changed
+
+def configure_sqlite(engine, journal_mode=None, busy_timeout=None, synchronous=None, query_only=False):
+    """
+    Sets the pragmas of every new connection of a SQLite engine, engines of other databases are left unchanged. 
+    Has to be called before the engine connects for the first time.
+
+    Parameters:
+    - engine: The engine to configure.
+    - journal_mode (str, optional): The journal mode, e.g. 'WAL' so that reading does not block writing and writing 
+      does not block reading. The journal mode is kept unchanged if not given.
+    - busy_timeout (int, optional): Milliseconds to wait for a lock held by another connection before failing.
+    - synchronous (str, optional): How often SQLite waits for data to be written to disk, e.g. 'NORMAL', which is safe with WAL.
+    - query_only (bool, optional): Whether the connections can only read from the database. Defaults to False.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    pragmas = []
+    if busy_timeout is not None:
+        pragmas.append("PRAGMA busy_timeout = {:d}".format(int(busy_timeout)))
+    if journal_mode and not query_only:
+        pragmas.append("PRAGMA journal_mode = {}".format(journal_mode))
+    if synchronous:
+        pragmas.append("PRAGMA synchronous = {}".format(synchronous))
+    if query_only:
+        pragmas.append("PRAGMA query_only = ON")
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+def execute_read(statement):
+    """
+    Executes a statement that only reads from the database, such as the queries for checking a text, with the read-only 
+    engine (bind key 'readonly') if it is configured and the default engine otherwise. Requires an active Flask application context.
+
+    Parameters:
+    - statement: The select statement to execute.
 
+    Returns:
+    - Result: The result of the statement.
+    """
+    engine = db.engines.get('readonly')
+    if engine is None:
+        return db.session.execute(statement)
+    return db.session.execute(statement, bind_arguments={"bind": engine})
@@ -0,0 +1,113 @@
+import multiprocessing
+import threading
+from collections import deque
+
+# lexicons of the process the worker processes were forked from, by language
+_worker_lexicons = {}
+
+
+def _tokenize_and_stem(language, text):
+    # runs in a worker process, the lexicons and the tokenizer were loaded before the worker was forked
+    import textchecker
+    words, spans = textchecker.tokenize_with_spans(text, language)
+    return words, spans, textchecker.stem_words(words, _worker_lexicons[language])
+
+
+class StemmingPool(object):
+    """
+    Pool of worker processes that tokenize and stem shards of long texts on all CPU cores. The workers are forked from the
+    current process, so they share its lexicons instead of loading them, and they are forked again when the lexicons change.
+    """
+
+    def __init__(self, workers):
+        """
+        Parameters:
+        - workers (int): The number of worker processes.
+        """
+        self.workers = workers
+        self._pool = None
+        self._lexicons = None
+        # number of texts being processed by each pool, a pool replaced because the lexicons changed is stopped
+        # when its last text is done
+        self._users = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        """ Returns whether worker processes can be forked from the current process, which is not possible in worker processes themselves. """
+        return "fork" in multiprocessing.get_all_start_methods() and not multiprocessing.current_process().daemon
+
+    def _acquire_pool(self, lexicons):
+        retired = None
+        with self._lock:
+            if self._pool is None or self._lexicons != lexicons:
+                if self._pool is not None and not self._users.get(self._pool):
+                    retired = self._pool
+                global _worker_lexicons
+                _worker_lexicons = dict(lexicons)
+                self._pool = multiprocessing.get_context("fork").Pool(self.workers)
+                self._lexicons = dict(lexicons)
+            pool = self._pool
+            self._users[pool] = self._users.get(pool, 0) + 1
+        if retired is not None:
+            self._stop(retired)
+        return pool
+
+    def _release_pool(self, pool):
+        with self._lock:
+            if pool not in self._users:
+                # all workers were stopped by close
+                return
+            self._users[pool] -= 1
+            retired = pool is not self._pool and self._users[pool] == 0
+            if self._users[pool] == 0:
+                del self._users[pool]
+        if retired:
+            self._stop(pool)
+
+    @staticmethod
+    def _stop(pool):
+        # the workers finish the queued shards and exit, and are waited for so no process is left behind
+        pool.close()
+        pool.join()
+
+    def map_shards(self, lexicons, language, shards):
+        """
+        Tokenizes and stems the shards of a text in the worker processes. Only a few shards per worker are sent at a time.
+
+        Parameters:
+        - lexicons (dict): The current lexicon of each language by language, the workers are forked again if they changed.
+        - language (str): The language of the text.
+        - shards (iterable): (offset, text) tuples of the shards of whole sentences of the text (see iter_text_chunks).
+
+        Yields:
+        - tuple: The offset of each shard, its words, the (start, end) character offsets of the words in the shard and
+          the stemmed words (see stem_words), in the order of the shards.
+        """
+        # texts still being processed keep using the workers they started with when the lexicons change
+        pool = self._acquire_pool(lexicons)
+        try:
+            pending = deque()
+            for offset, text in shards:
+                pending.append((offset, pool.apply_async(_tokenize_and_stem, (language, text))))
+                # wait for the oldest shard once every worker has enough work queued
+                if len(pending) >= 2 * self.workers:
+                    offset, result = pending.popleft()
+                    yield (offset,) + result.get()
+            while pending:
+                offset, result = pending.popleft()
+                yield (offset,) + result.get()
+        finally:
+            self._release_pool(pool)
+
+    def close(self):
+        """ Stops all worker processes. """
+        with self._lock:
+            pools = set(self._users)
+            if self._pool is not None:
+                pools.add(self._pool)
+            self._pool = None
+            self._users = {}
+        for pool in pools:
+            pool.terminate()
+            pool.join()
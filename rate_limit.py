@@ -0,0 +1,38 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter(object):
+    """ Limits the number of requests per client with a token bucket for each client """
+
+    def __init__(self, per_minute=60, burst=20, max_clients=10000):
+        """
+        Parameters:
+        - per_minute (float, optional): The number of requests per minute a client can make on average. Defaults to 60.
+        - burst (int, optional): The number of requests a client can make at once after not making any for a while. Defaults to 20.
+        - max_clients (int, optional): The maximum number of clients to remember, the least recently seen ones are forgotten first. Defaults to 10000.
+        """
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self.rejected = 0
+        self._buckets = OrderedDict()  # client -> (tokens, time of the last request)
+        self._lock = threading.Lock()
+
+    def allow(self, client):
+        """ Returns whether the client may make another request now, and counts the request if it may. """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            # refill the bucket for the time since the last request
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.rejected += 1
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed
@@ -1,8 +1,16 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
-from models import db, Term, AlternativeTerm, AlternativeRating, OffensivenessRating
+from models import (db, Term, AlternativeTerm, AlternativeRating, OffensivenessRating, OffensivenessCount, AlternativeRatingAggregate, 
+                    TermSource, increase_sync_version)
+from lexicon import invalidate_lexicons
+from term_search import search_index_exists, fill_search_index
+from languages import get_language, language_for_code
+import hashlib
 import json
+import time
 from itertools import count
 
 app = Flask(__name__)
@@ -10,7 +18,247 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sensitive_terms.sqlite'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
 
-def insert_data():
+def generate_ids(used_ids):
+    """ Generates new unique term ids (zero padded counters) that are not in the given set of used ids. """
+    for number in count(1):
+        new_id = f"{number:020}"
+        if new_id not in used_ids:
+            yield new_id
+
+
+def build_term_rows(terms_data, data, existing_ids_by_term=None):
+    """
+    Builds the rows of the `terms` table from the JSON data in memory.
+
+    Parameters:
+    - terms_data (list): The terms of 'terms.json', providing the ids and definitions.
+    - data (list): The terms of 'modified_data.json', providing the lemma, language and translations.
+    - existing_ids_by_term (dict, optional): Ids of the terms that are already in the database by their term, these ids are 
+      kept so that re-imports update the existing terms.
+
+    Returns:
+    - list: A dictionary with the columns of the `terms` table for each term, in the order of 'modified_data.json'. 
+      If a lemma appears more than once, only the first one is used.
+    """
+    existing_ids_by_term = existing_ids_by_term or {}
+    value_to_id = {item['value']: item['id'] for item in terms_data}
+    value_to_def = {item['value']: item['definition'] for item in terms_data}
+
+    # Collect translation relationships
+    # Two terms appear together in the AlternativeTerm list if they share at least one translation, 
+    # indicating they are contextually related or interchangeable in some scenarios
+    translation_to_terms = {}  # Maps a translation to all terms that include it
+    for item in data:
+        for translation in item.get('translations', []):
+            translation_to_terms.setdefault(translation, set()).add(item['lemma'])
+
+    term_to_alternatives = {item['lemma']: set() for item in data}
+    for terms in translation_to_terms.values():
+        for term in terms:
+            # Exclude the term itself from its alternatives list
+            term_to_alternatives[term].update(t for t in terms if t != term)
+
+    # ids of terms.json and of existing terms are reserved, new ids are generated for the other terms
+    used_ids = set(value_to_id.values()) | set(existing_ids_by_term.values())
+    new_ids = generate_ids(used_ids)
+
+    rows = []
+    seen_terms = set()
+    for item in data:
+        lemma = item['lemma']
+        if lemma in seen_terms:
+            print(f"Skipping duplicate term: {lemma}")
+            continue
+        seen_terms.add(lemma)
+
+        # the language of the term by its language code (see languages.py)
+        language = language_for_code(item['lemma_lang'])
+        if language is None:
+            print(f"Skipping term in unsupported language {item['lemma_lang']}: {lemma}")
+            continue
+
+        # find definitions
+        term_def = value_to_def.get(lemma, None)
+        if term_def:
+            definition = term_def.get(get_language(language).definition_key, "")
+        else:
+            definition = "No definition available"
+
+        term_id = existing_ids_by_term.get(lemma) or value_to_id.get(lemma) or next(new_ids)
+        rows.append({
+            "id": term_id,
+            "term": lemma,
+            "description": definition,
+            "language": language,
+            "alternatives_list": json.dumps(sorted(term_to_alternatives[lemma]), ensure_ascii=False),
+        })
+    return rows
+
+
+def build_alternative_pairs(data, term_ids_by_term):
+    """
+    Builds the symmetric alternative relationships of terms that share at least one translation.
+
+    Parameters:
+    - data (list): The terms of 'modified_data.json', providing the lemma and translations.
+    - term_ids_by_term (dict): The ids of all terms in the database by their term.
+
+    Returns:
+    - list: (original term id, alternative term id) tuples without duplicates or self references, both directions of 
+      each relationship are included.
+    """
+    # Maps a translation to all terms that include it, in the order of the data
+    translation_to_terms = {}
+    for item in data:
+        for translation in item.get('translations', []):
+            translation_to_terms.setdefault(translation, []).append(item['lemma'])
+
+    pairs = []
+    seen = set()
+    for item in data:
+        original_term_id = term_ids_by_term.get(item['lemma'])
+        if original_term_id is None:
+            continue
+        for translation in item.get('translations', []):
+            for other_term in translation_to_terms[translation]:
+                alternative_term_id = term_ids_by_term.get(other_term)
+                # Avoid duplicates and self-references
+                if alternative_term_id is None or alternative_term_id == original_term_id or (original_term_id, alternative_term_id) in seen:
+                    continue
+                for pair in ((original_term_id, alternative_term_id), (alternative_term_id, original_term_id)):
+                    if pair not in seen:
+                        seen.add(pair)
+                        pairs.append(pair)
+    return pairs
+
+
+def source_hash(row):
+    """ Returns a hash of the imported data of a term (see build_term_rows), which changes whenever its source records change. """
+    values = [row[column] for column in ("term", "description", "language", "alternatives_list")]
+    return hashlib.sha256(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def sync_data(database=db, terms_path='terms.json', data_path='modified_data.json', remove=False):
+    """
+    Synchronizes the terms and their alternatives in the database with the JSON files, applying only the changes.
+
+    A hash of the data of each imported term is stored in the `term_sources` table. Terms whose hash changed or that are new 
+    are inserted or updated and relationships are added as the shared translations change. Only if `remove` is given, terms 
+    that were imported before but are no longer in the files are removed together with their alternative relationships and 
+    all their ratings (also as an alternative), and relationships between imported terms that no longer share a translation 
+    are removed. Otherwise these terms are only counted, so that an incomplete file can't delete collected ratings. Terms 
+    that were not imported from the files (e.g. added by an admin) are kept. All changes are written in a single transaction.
+
+    If anything changed, the 'terms' version in the `sync_state` table is increased so that running processes rebuild 
+    their lexicons (see refresh_lexicons_if_synced in lexicon.py), and the search index of the terms is rebuilt (see term_search.py).
+
+    Parameters:
+    - database (SQLAlchemy, optional): The database to synchronize. Defaults to the database of models.py.
+    - terms_path (str, optional): Path of the JSON file with the ids and definitions of the terms. Defaults to 'terms.json'.
+    - data_path (str, optional): Path of the JSON file with the terms. Defaults to 'modified_data.json'.
+    - remove (bool, optional): Whether to remove terms and relationships that are no longer in the files, and the ratings
+      of the removed terms. Defaults to False.
+
+    Returns:
+    - dict: The number of 'added', 'changed', 'removed' and 'unchanged' terms, of 'alternatives_added' and 
+      'alternatives_removed', of 'ratings_removed', of terms that are no longer in the files but were kept ('missing') 
+      and of their ratings ('missing_ratings'), and the 'seconds' it took.
+
+    Requires:
+    - A Flask application context to be active, with a configured SQLAlchemy instance pointing to 
+      the target SQLite database.
+    """
+    start_time = time.perf_counter()
+    session = database.session
+
+    with open(terms_path, 'r', encoding='utf-8') as terms_file:
+        terms_data = json.load(terms_file)
+    with open(data_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    try:
+        # load the existing terms and the hashes of their sources once to decide which terms changed
+        existing_ids_by_term = dict(session.execute(select(Term.term, Term.id)).all())
+        existing_ids = set(existing_ids_by_term.values())
+        source_hashes = dict(session.execute(select(TermSource.term_id, TermSource.source_hash)).all())
+
+        rows = build_term_rows(terms_data, data, existing_ids_by_term)
+        hashes = {row["id"]: source_hash(row) for row in rows}
+        changed_rows = [row for row in rows if source_hashes.get(row["id"]) != hashes[row["id"]]]
+        added = sum(1 for row in changed_rows if row["id"] not in existing_ids)
+
+        if changed_rows:
+            statement = sqlite_insert(Term)
+            statement = statement.on_conflict_do_update(
+                index_elements=[Term.id],
+                set_={column: statement.excluded[column] for column in ("term", "description", "language", "alternatives_list")})
+            session.execute(statement, changed_rows)
+
+            statement = sqlite_insert(TermSource)
+            statement = statement.on_conflict_do_update(index_elements=[TermSource.term_id], set_={"source_hash": statement.excluded.source_hash})
+            session.execute(statement, [{"term_id": row["id"], "source_hash": hashes[row["id"]]} for row in changed_rows])
+
+        # terms that were imported before but are no longer in the files, and the number of their ratings
+        missing_ids = set(source_hashes) - set(hashes)
+        missing_ratings = count_ratings(session, missing_ids)
+        removed_ids = missing_ids if remove else set()
+        term_ids_by_term = {term: term_id for term, term_id in existing_ids_by_term.items() if term_id not in removed_ids}
+        term_ids_by_term.update((row["term"], row["id"]) for row in rows)
+
+        # link alternative terms based on shared translations
+        pairs = build_alternative_pairs(data, term_ids_by_term)
+        existing_pairs = {(original_term_id, alternative_term_id): pair_id for pair_id, original_term_id, alternative_term_id
+                          in session.execute(select(AlternativeTerm.id, AlternativeTerm.original_term_id, AlternativeTerm.alternative_term_id))}
+        new_pairs = [pair for pair in pairs if pair not in existing_pairs]
+        if new_pairs:
+            session.execute(insert(AlternativeTerm), [{"original_term_id": original_term_id, "alternative_term_id": alternative_term_id}
+                                                      for original_term_id, alternative_term_id in new_pairs])
+
+        # remove relationships of removed terms, and relationships between imported terms that no longer share a translation
+        stale_pair_ids = []
+        if remove:
+            imported_ids = set(hashes) | removed_ids
+            pairs = set(pairs)
+            stale_pair_ids = [pair_id for pair, pair_id in existing_pairs.items() if pair not in pairs and
+                              (pair[0] in removed_ids or pair[1] in removed_ids or (pair[0] in imported_ids and pair[1] in imported_ids))]
+            if stale_pair_ids:
+                session.execute(delete(AlternativeTerm).where(AlternativeTerm.id.in_(stale_pair_ids)))
+            if removed_ids:
+                # the ratings of removed terms, or of removed terms as alternatives, can't be shown any more
+                session.execute(delete(OffensivenessRating).where(OffensivenessRating.term_id.in_(removed_ids)))
+                session.execute(delete(OffensivenessCount).where(OffensivenessCount.term_id.in_(removed_ids)))
+                session.execute(delete(AlternativeRating).where(AlternativeRating.term_id.in_(removed_ids) 
+                                                                | AlternativeRating.alternative_term_id.in_(removed_ids)))
+                session.execute(delete(AlternativeRatingAggregate).where(AlternativeRatingAggregate.term_id.in_(removed_ids) 
+                                                                         | AlternativeRatingAggregate.alternative_term_id.in_(removed_ids)))
+                session.execute(delete(TermSource).where(TermSource.term_id.in_(removed_ids)))
+                session.execute(delete(Term).where(Term.id.in_(removed_ids)))
+
+        changed = bool(changed_rows or new_pairs or stale_pair_ids or removed_ids)
+        if changed:
+            # signal the running processes that the terms changed
+            increase_sync_version('terms')
+            # update the search index in the same transaction, so searches never see it out of date
+            if search_index_exists(session.connection()):
+                fill_search_index(session.connection())
+        session.commit()
+    except IntegrityError as e:
+        print(f"IntegrityError: {e}")
+        session.rollback()
+        raise
+
+    if changed:
+        # the terms were changed without the ORM, so the lexicons have to be rebuilt explicitly
+        invalidate_lexicons()
+
+    return {"added": added, "changed": len(changed_rows) - added, "removed": len(removed_ids), 
+            "unchanged": len(rows) - len(changed_rows), "alternatives_added": len(new_pairs), 
+            "alternatives_removed": len(stale_pair_ids), "ratings_removed": missing_ratings if remove else 0,
+            "missing": 0 if remove else len(missing_ids), "missing_ratings": 0 if remove else missing_ratings,
+            "seconds": time.perf_counter() - start_time}
+
+
+def insert_data(database=db, terms_path='terms.json', data_path='modified_data.json'):
     """
     Inserts terms from a JSON file into a SQLite database, managing both new and existing entries.
 
@@ -20,8 +268,15 @@ def insert_data():
     definitions appropriately. If a term's definition is missing, a default message is used. The 
     function also ensures that alternative term relationships are symmetric and avoids duplicates.
 
+    All terms and relationships are computed in memory and written with bulk statements in a single 
+    transaction. Loading the same files again is idempotent: existing terms keep their ids and are only 
+    updated if their data changed, and only missing relationships are added. Unlike sync_data, nothing 
+    is removed.
+
     Parameters:
-    - None: This function does not take any parameters.
+    - database (SQLAlchemy, optional): The database to insert the terms into. Defaults to the database of models.py.
+    - terms_path (str, optional): Path of the JSON file with the ids and definitions of the terms. Defaults to 'terms.json'.
+    - data_path (str, optional): Path of the JSON file with the terms to insert. Defaults to 'modified_data.json'.
 
     Files read:
     - 'terms.json': Contains initial terms with IDs, values, and definitions.
@@ -32,9 +287,9 @@ def insert_data():
       and alternatives list.
     - Inserts new relationships into the `AlternativeTerm` table, ensuring that each relationship 
       is represented both ways (symmetrically) between terms.
-    - Checks for existing terms and relationships to prevent duplicates.
-    - Uses a counter to generate new unique IDs for terms that do not already have one.
 
+    Returns:
+    - dict: The statistics of the changes as returned by sync_data.
 
     Requires:
     - A Flask application context to be active, with a configured SQLAlchemy instance pointing to 
@@ -42,106 +297,33 @@ def insert_data():
     - The `models.py` file should define the SQLAlchemy models `Term`, `AlternativeTerm`, `AlternativeRating`, 
       and `OffensivenessRating`.
     """
-    with open('terms.json', 'r', encoding='utf-8') as terms_file:
-        terms_data = json.load(terms_file)
-        value_to_id = {item['value']: item['id'] for item in terms_data}
-        value_to_def = {item['value']: item['definition'] for item in terms_data}
-        
-    with open('modified_data.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    return sync_data(database, terms_path, data_path, remove=False)
+
+
+def count_ratings(session, term_ids):
+    """ Returns the number of offensiveness and alternative ratings of the given terms, including ratings of them as an alternative. """
+    if not term_ids:
+        return 0
+    offensiveness_ratings = session.execute(select(func.count(OffensivenessRating.id))
+                                            .where(OffensivenessRating.term_id.in_(term_ids))).scalar()
+    alternative_ratings = session.execute(select(func.count(AlternativeRating.id))
+                                          .where(AlternativeRating.term_id.in_(term_ids) | AlternativeRating.alternative_term_id.in_(term_ids))).scalar()
+    return offensiveness_ratings + alternative_ratings
+
 
-        # Initialize counter for new IDs
-        initial_id_num = 1
-        id_counter = count(initial_id_num)
-
-        # Function to generate new IDs
-        def generate_new_id():
-            return f"{next(id_counter):020}"
-        
-        # Collect translation relationships
-        # Two terms appear together in the AlternativeTerm list if they share at least one translation, 
-        # indicating they are contextually related or interchangeable in some scenarios
-        translation_to_terms = {}  # Maps a translation to all terms that include it
-        for item in data:
-            for translation in item.get('translations', []):
-                if translation not in translation_to_terms:
-                    translation_to_terms[translation] = set()
-                translation_to_terms[translation].add(item['lemma'])
-        
-        # Convert sets to lists for JSON serialization
-        term_to_alternatives = {item['lemma']: [] for item in data}
-        for translation, terms in translation_to_terms.items():
-            for term in terms:
-                # Exclude the term itself from its alternatives list
-                term_to_alternatives[term].extend([t for t in terms if t != term])
-        
-        # Ensure unique entries
-        for term, alternatives in term_to_alternatives.items():
-            term_to_alternatives[term] = list(set(alternatives))
-
-        # build single terms
-        for item in data:
-            language = "german" if item['lemma_lang'] == 'de' else "english"
-            term_id = value_to_id.get(item['lemma'])
-            
-            # Check if term definition exists and is not None
-            term_def = value_to_def.get(item['lemma'], None)
-            # find definitions
-            if term_def:
-                definition_key = "langB" if language == "german" else "langA"
-                definition = term_def.get(definition_key, "")
-            else:
-                definition = "No definition available"
-
-            # Generate a new ID if none is found
-            if term_id is None:
-                while True:
-                    potential_new_id = generate_new_id()
-                    if not Term.query.filter_by(id=potential_new_id).first():
-                        term_id = potential_new_id
-                        break
-            
-            try:
-                # Update to use collected relationships for alternatives_list
-                alternatives_list = json.dumps(term_to_alternatives[item['lemma']], ensure_ascii=False)
-                # build term object
-                term = Term(
-                    id=term_id,
-                    term=bytes(item['lemma'], "utf-8").decode("utf-8"), 
-                    description= bytes(definition, "utf-8").decode("utf-8"), 
-                    language=language,
-                    alternatives_list=alternatives_list
-                )
-                db.session.add(term)
-                db.session.commit()
-            except IntegrityError as e:
-                print(f"IntegrityError: {e}")
-                db.session.rollback()
-
-
-
-        # After inserting terms, create a dictionary for quick access to terms by name
-        terms_dict = {term.term: term for term in Term.query.all()}
-
-        # Identify alternative terms based on shared translations
-        for item in data:
-            if item['lemma'] in terms_dict:
-                original_term = terms_dict[item['lemma']]
-                for translation in item.get('translations', []):
-                    for other_item in data:
-                        if translation in other_item.get('translations', []) and other_item['lemma'] != item['lemma'] and other_item['lemma'] in terms_dict:
-                            alternative_term = terms_dict[other_item['lemma']]
-                            # Use the id from terms_dict (which is now correctly linked to terms.json IDs)
-                            original_term_id = original_term.id
-                            alternative_term_id = alternative_term.id
-                            # Avoid duplicates and self-references
-                            if original_term_id != alternative_term_id and not AlternativeTerm.query.filter_by(original_term_id=original_term_id, alternative_term_id=alternative_term_id).first():
-                                db.session.add(AlternativeTerm(original_term_id=original_term_id, alternative_term_id=alternative_term_id))
-                                db.session.add(AlternativeTerm(original_term_id=alternative_term_id, alternative_term_id=original_term_id))
-                            db.session.commit()
+def format_sync_stats(stats):
+    """ Returns a summary of the statistics returned by sync_data, with a warning if terms are no longer in the files. """
+    summary = ("Added {added}, changed {changed}, removed {removed} and kept {unchanged} terms, "
+               "added {alternatives_added} and removed {alternatives_removed} alternatives, "
+               "removed {ratings_removed} ratings in {seconds:.2f}s").format(**stats)
+    if stats["missing"]:
+        summary += ("\nWarning: {missing} terms are no longer in the files and were kept with their {missing_ratings} ratings, "
+                    "sync with --remove to delete them and their ratings").format(**stats)
+    return summary
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
-        insert_data()
+        stats = insert_data()
+        print(format_sync_stats(stats))
 
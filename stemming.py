@@ -0,0 +1,58 @@
+import threading
+from functools import lru_cache
+
+# maximum number of stemmed words to remember per language
+STEM_CACHE_SIZE = 100000
+
+# stemmers by language, shared by all requests and threads
+_stemmers = {}
+_stemmers_lock = threading.Lock()
+
+
+class Stemmer(object):
+    """ Snowball stemmer for one language that remembers the stems of the most recently stemmed words """
+
+    def __init__(self, language, maxsize=STEM_CACHE_SIZE):
+        """
+        Parameters:
+        - language (str): The language of the stemmer, one of the languages supported by the Snowball stemmer.
+        - maxsize (int, optional): The maximum number of stems to remember, the least recently used ones are removed first. Defaults to STEM_CACHE_SIZE.
+        """
+        # nltk is only imported when it is needed, as importing it takes a while
+        from nltk.stem import SnowballStemmer
+        self.language = language
+        self.snowball_stemmer = SnowballStemmer(language)
+        # words in texts are heavily repeated, so most words were already stemmed before
+        self.stem = lru_cache(maxsize=maxsize)(self.snowball_stemmer.stem)
+
+    def stats(self):
+        """ Returns a dictionary with the size, hits, misses and hit rate of the remembered stems. """
+        info = self.stem.cache_info()
+        lookups = info.hits + info.misses
+        return {"size": info.currsize, "maxsize": info.maxsize, "hits": info.hits, "misses": info.misses,
+                "hit_rate": info.hits / lookups if lookups else 0.0}
+
+
+def get_stemmer(language):
+    """
+    Returns the stemmer for the given language, which is created once and shared by all lexicons, requests and threads.
+
+    Parameters:
+    - language (str): The language used for stemming, one of the supported languages.
+
+    Returns:
+    - Stemmer: The stemmer of the language.
+    """
+    stemmer = _stemmers.get(language)
+    if stemmer is None:
+        with _stemmers_lock:
+            stemmer = _stemmers.get(language)
+            if stemmer is None:
+                stemmer = Stemmer(language)
+                _stemmers[language] = stemmer
+    return stemmer
+
+
+def stemming_stats():
+    """ Returns the statistics of the remembered stems (see Stemmer.stats) of each language by language. """
+    return {language: stemmer.stats() for language, stemmer in _stemmers.items()}
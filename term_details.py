@@ -0,0 +1,108 @@
+from sqlalchemy import select, func
+
+from models import Term, AlternativeTerm, AlternativeRatingAggregate, OffensivenessCount, execute_read
+from lexicon import get_terms_version
+from caches import LRUCache
+
+# maximum number of terms whose ranked alternatives are kept in memory
+ALTERNATIVES_CACHE_SIZE = 10000
+
+# ranked alternatives of the most recently used terms with the version of the terms they were loaded for
+_ranked_alternatives = LRUCache(ALTERNATIVES_CACHE_SIZE)
+# number of times cached alternatives were invalidated
+_invalidations = 0
+
+
+def load_alternatives(term_ids):
+    """
+    Loads the alternatives of the given terms with their average ratings, ranked by the database.
+
+    The ranked alternatives of each term are cached until one of them is rated (see invalidate_alternatives) or the terms change.
+
+    Parameters:
+    - term_ids (iterable): The ids of the terms for which to load the alternatives.
+
+    Returns:
+    - dict: Maps each term id to a list of (alternative term, average rating) tuples, ordered by the average rating (descending, 
+      alternatives that have not been rated yet count as the middle value 2.5) and then by the order the alternatives were added. 
+      The alternative term has the attributes id, term, description and rating_count, the average rating is None if the 
+      alternative has not been rated yet. The lists are shared with the cache and must not be modified.
+    """
+    term_ids = set(term_ids)
+    version = get_terms_version()
+    alternatives = {}
+    for term_id in term_ids:
+        cached = _ranked_alternatives.get(term_id)
+        if cached is not None and cached[0] == version:
+            alternatives[term_id] = cached[1]
+
+    missing_ids = term_ids - alternatives.keys()
+    if not missing_ids:
+        return alternatives
+
+    # ratings written while the alternatives are loaded must not be overwritten by the cached alternatives
+    invalidations = _invalidations
+    loaded = {term_id: [] for term_id in missing_ids}
+
+    # alternative terms of the terms with the sum and number of their ratings, best rated first
+    average_rating = func.coalesce(AlternativeRatingAggregate.rating_sum * 1.0 / AlternativeRatingAggregate.rating_count, 2.5)
+    rows = execute_read(
+        select(AlternativeTerm.original_term_id, Term.id, Term.term, Term.description,
+               AlternativeRatingAggregate.rating_sum, AlternativeRatingAggregate.rating_count)
+        .join(Term, Term.id == AlternativeTerm.alternative_term_id)
+        .outerjoin(AlternativeRatingAggregate, (AlternativeRatingAggregate.term_id == AlternativeTerm.original_term_id)
+                   & (AlternativeRatingAggregate.alternative_term_id == AlternativeTerm.alternative_term_id))
+        .where(AlternativeTerm.original_term_id.in_(missing_ids))
+        .order_by(average_rating.desc(), AlternativeTerm.id))
+    for row in rows:
+        average = row.rating_sum / row.rating_count if row.rating_count else None
+        loaded[row.original_term_id].append((row, average))
+
+    for term_id, ranked in loaded.items():
+        if invalidations == _invalidations:
+            _ranked_alternatives.put(term_id, (version, ranked))
+        alternatives[term_id] = ranked
+    return alternatives
+
+
+def invalidate_alternatives(term_id):
+    """ Removes the cached alternatives of the given term, has to be called whenever one of its alternatives is rated. """
+    global _invalidations
+    _invalidations += 1
+    _ranked_alternatives.discard(term_id)
+
+
+def clear_alternatives():
+    """ Removes all cached alternatives, e.g. when ratings were written by another process. """
+    global _invalidations
+    _invalidations += 1
+    _ranked_alternatives.clear()
+
+
+def alternatives_cache_stats():
+    """ Returns the statistics of the cached alternatives (see LRUCache.stats). """
+    return _ranked_alternatives.stats()
+
+
+def load_offensiveness_counts(term_ids):
+    """
+    Loads how many times each of the given terms was marked as offensive.
+
+    Parameters:
+    - term_ids (iterable): The ids of the terms for which to load the counts.
+
+    Returns:
+    - dict: Maps each term id to the number of times the term was marked as offensive.
+    """
+    term_ids = set(term_ids)
+    counts = {term_id: 0 for term_id in term_ids}
+    if not term_ids:
+        return counts
+
+    rows = execute_read(
+        select(OffensivenessCount.term_id, OffensivenessCount.count)
+        .where(OffensivenessCount.term_id.in_(term_ids)))
+    for term_id, count in rows:
+        counts[term_id] = count
+    return counts
+
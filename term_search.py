@@ -0,0 +1,235 @@
+import re
+import threading
+
+from sqlalchemy import event, select, text, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+
+from models import db, Term, SyncState, execute_read, increase_sync_version
+from lexicon import SpellingIndex, TermRecord, get_terms_version
+from languages import LANGUAGES, get_language
+from stemming import get_stemmer
+
+# ways of searching the terms: by the beginning of their words, by the stems of their words, by the words of the terms and
+# their descriptions, and by terms spelled similarly to the search text
+SEARCH_MODES = ("prefix", "stem", "text", "fuzzy")
+
+# key of the `sync_state` row holding the version of the terms the search index was built from
+SEARCH_INDEX_KEY = 'term_search'
+
+# the search index is a full-text table of SQLite (FTS5) in the same database, which is kept in sync with the terms
+# table. Diacritics are ignored, so "fur" also finds "für", and prefixes of 2 and 3 characters are indexed for fast prefix search
+SEARCH_INDEX_DDL = ("CREATE VIRTUAL TABLE IF NOT EXISTS term_search USING fts5("
+                    "term_id UNINDEXED, language UNINDEXED, term, stems, description, "
+                    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+
+# the index is only rebuilt by one thread of the process at a time
+_index_lock = threading.Lock()
+
+# indexes of the spellings of the terms by language for the fuzzy search, with the version of the terms they were built from
+_fuzzy_indexes = {}
+_fuzzy_lock = threading.Lock()
+
+
+def create_search_index():
+    """
+    Creates the full-text table of the search index if it does not exist yet. Requires an active Flask application context.
+
+    Returns:
+    - bool: Whether the search index is available, which requires SQLite with FTS5.
+    """
+    if db.engine.dialect.name != "sqlite":
+        return False
+    try:
+        db.session.execute(text(SEARCH_INDEX_DDL))
+        db.session.commit()
+    except OperationalError as e:
+        db.session.rollback()
+        print(f"Warning: the term search is not available, SQLite was built without FTS5: {e}")
+        return False
+    return True
+
+
+def search_index_exists(connection):
+    """ Returns whether the table of the search index exists in the database of the connection. """
+    if connection.dialect.name != "sqlite":
+        return False
+    return connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'term_search'")).first() is not None
+
+
+def _stem_term(term, language):
+    # the stems of the words of a term as they are stemmed by the lexicons, terms of unregistered languages are not stemmed
+    pipeline = LANGUAGES.get(language)
+    if pipeline is None:
+        return ""
+    stemmer = get_stemmer(pipeline.stemmer_language)
+    return " ".join(stemmer.stem(word) for word in term.split())
+
+
+def _index_row(term_id, language, term, description):
+    return {"term_id": term_id, "language": language, "term": term or "", "stems": _stem_term(term or "", language),
+            "description": description or ""}
+
+
+_INSERT_INDEX_ROW = text("INSERT INTO term_search (term_id, language, term, stems, description) "
+                         "VALUES (:term_id, :language, :term, :stems, :description)")
+
+
+def fill_search_index(connection):
+    """
+    Fills the search index with all terms, their stems and descriptions, together with the version of the terms it was 
+    built from, in the current transaction of the connection. The changes are not committed.
+
+    Parameters:
+    - connection: The connection to the database, e.g. of the session that changed the terms (see sync_data in read_data.py).
+
+    Returns:
+    - int: The number of indexed terms.
+    """
+    # the version is read in the same transaction as the terms, so it is the version of the indexed terms
+    version = connection.execute(select(SyncState.version).where(SyncState.key == 'terms')).scalar() or 0
+    rows = connection.execute(select(Term.id, Term.language, Term.term, Term.description)).all()
+    connection.execute(text("DELETE FROM term_search"))
+    if rows:
+        connection.execute(_INSERT_INDEX_ROW, [_index_row(*row) for row in rows])
+    connection.execute(sqlite_insert(SyncState)
+                       .values(key=SEARCH_INDEX_KEY, version=version)
+                       .on_conflict_do_update(index_elements=['key'], set_={'version': version}))
+    return len(rows)
+
+
+def refresh_search_index():
+    """
+    Rebuilds the search index if it was never built or does not match the version of the terms, e.g. because the terms
+    were changed by an older version of the app. Called when the app is warmed up, the changes of the terms update the
+    index themselves. Requires an active Flask application context.
+
+    Returns:
+    - bool: Whether the search index was rebuilt.
+    """
+    with _index_lock:
+        versions = dict(db.session.execute(select(SyncState.key, SyncState.version)
+                                           .where(SyncState.key.in_(['terms', SEARCH_INDEX_KEY]))).all())
+        # the index was never built if there is no version for it
+        if SEARCH_INDEX_KEY in versions and versions[SEARCH_INDEX_KEY] == versions.get('terms', 0):
+            db.session.rollback()
+            return False
+        try:
+            fill_search_index(db.session.connection())
+            db.session.commit()
+        except OperationalError:
+            db.session.rollback()
+            raise
+    return True
+
+
+def _update_indexed_term(mapper, connection, target):
+    # keep the search index in sync with the terms changed through the ORM (e.g. by an admin), in the same transaction
+    if not search_index_exists(connection):
+        return
+    connection.execute(text("DELETE FROM term_search WHERE term_id = :term_id"), {"term_id": target.id})
+    connection.execute(_INSERT_INDEX_ROW, _index_row(target.id, target.language, target.term, target.description))
+    # the 'terms' version is increased for every change as well (see lexicon.py), so both versions stay the same
+    increase_sync_version(SEARCH_INDEX_KEY, connection)
+
+
+def _remove_indexed_term(mapper, connection, target):
+    if not search_index_exists(connection):
+        return
+    connection.execute(text("DELETE FROM term_search WHERE term_id = :term_id"), {"term_id": target.id})
+    increase_sync_version(SEARCH_INDEX_KEY, connection)
+
+
+event.listen(Term, 'after_insert', _update_indexed_term)
+event.listen(Term, 'after_update', _update_indexed_term)
+event.listen(Term, 'after_delete', _remove_indexed_term)
+
+
+def _quote(word):
+    # a word of the search text as a string of the FTS5 query syntax, so operators in the text are searched literally
+    return '"{}"'.format(word.replace('"', '""'))
+
+
+def _match(expression, languages, limit):
+    # the terms of the languages matching the FTS5 query expression, as (rank, record) tuples with the best match first
+    statement = text("SELECT term_id, term, description, language, rank FROM term_search "
+                     "WHERE term_search MATCH :expression AND language IN :languages "
+                     "ORDER BY rank, length(term) LIMIT :limit").bindparams(
+        bindparam("expression", value=expression), bindparam("languages", value=list(languages), expanding=True),
+        bindparam("limit", value=limit))
+    return [(row.rank, TermRecord(row.term_id, row.term, row.description, row.language)) for row in execute_read(statement)]
+
+
+def _get_fuzzy_index(language):
+    # the index of the lowercased terms of the language and their records by lowercased term, rebuilt when the terms change
+    version = get_terms_version()
+    cached = _fuzzy_indexes.get(language)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    with _fuzzy_lock:
+        cached = _fuzzy_indexes.get(language)
+        if cached is None or cached[0] != version:
+            records = {}
+            rows = execute_read(select(Term.id, Term.term, Term.description, Term.language).where(Term.language == language))
+            for row in rows:
+                records.setdefault((row.term or "").lower(), []).append(TermRecord(*row))
+            cached = (version, SpellingIndex(list(records), get_language(language).spelling_cutoff), records)
+            _fuzzy_indexes[language] = cached
+    return cached[1], cached[2]
+
+
+def search_terms(query, mode="prefix", languages=("english", "german"), limit=20):
+    """
+    Searches the terms of the given languages. Requires an active Flask application context, and the search index
+    (see create_search_index) for all modes but 'fuzzy'.
+
+    Parameters:
+    - query (str): The search text.
+    - mode (str, optional): How to search, one of SEARCH_MODES. Defaults to 'prefix'.
+      - 'prefix': terms with words beginning with each word of the text, e.g. "rac jus" finds "racial justice".
+      - 'stem': terms with the stems of all words of the text, stemmed like the texts of each language.
+      - 'text': terms with all words of the text in the term or its description, the last word can be incomplete.
+      - 'fuzzy': terms spelled similarly to the whole text, at least as similar as the spelling correction of the language requires.
+    - languages (iterable, optional): The languages of the terms to search, registered languages (see languages.py). Defaults to English and German.
+    - limit (int, optional): The maximum number of terms to return. Defaults to 20.
+
+    Returns:
+    - list: The records of the found terms (see TermRecord), the best match first.
+
+    Raises:
+    - ValueError: If the mode is not one of SEARCH_MODES.
+    """
+    languages = list(languages)
+    if mode not in SEARCH_MODES:
+        raise ValueError("Unknown search mode: {}".format(mode))
+
+    if mode == "fuzzy":
+        scored = []
+        for language in languages:
+            index, records = _get_fuzzy_index(language)
+            for similarity, term in index.most_similar(query.strip().lower(), limit):
+                scored.extend((similarity, record) for record in records[term])
+        # the most similar terms first, terms of the same similarity in the order of the languages
+        scored.sort(key=lambda result: -result[0])
+        return [record for _, record in scored[:limit]]
+
+    words = re.findall(r"\w+", query)
+    if not words:
+        return []
+
+    if mode == "stem":
+        # the words are stemmed differently in each language, so each language is searched with its own stems
+        results = []
+        for language in languages:
+            stemmer = get_stemmer(get_language(language).stemmer_language)
+            expression = "stems : ({})".format(" ".join(_quote(stemmer.stem(word)) for word in words))
+            results.extend(_match(expression, [language], limit))
+        results.sort(key=lambda result: result[0])
+        return [record for _, record in results[:limit]]
+
+    if mode == "prefix":
+        expression = "term : ({})".format(" ".join(_quote(word) + "*" for word in words))
+    else:
+        expression = "{{term description}} : ({})".format(" ".join([_quote(word) for word in words[:-1]] + [_quote(words[-1]) + "*"]))
+    return [record for _, record in _match(expression, languages, limit)]
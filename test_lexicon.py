@@ -0,0 +1,60 @@
+import difflib
+import json
+import os
+import random
+
+import pytest
+
+from lexicon import SpellingIndex
+from languages import LANGUAGES, language_for_code
+
+current_directory = os.path.dirname(os.path.realpath(__file__))
+
+
+def load_term_words():
+    # the words of the terms of each language, split like the lexicons split them
+    with open(os.path.join(current_directory, 'modified_data.json'), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    words = {}
+    for item in data:
+        language = language_for_code(item['lemma_lang'])
+        if language is not None:
+            words.setdefault(language, []).extend(item['lemma'].split(" "))
+    return words
+
+
+def perturbed_variants(word, rng):
+    # the word with one character deleted, one substituted and two neighbouring characters transposed
+    variants = [word, word.lower()]
+    if len(word) > 1:
+        position = rng.randrange(len(word))
+        variants.append(word[:position] + word[position+1:])
+        position = rng.randrange(len(word))
+        variants.append(word[:position] + rng.choice("aeiourstnx") + word[position+1:])
+        position = rng.randrange(len(word) - 1)
+        variants.append(word[:position] + word[position+1] + word[position] + word[position+2:])
+    return variants
+
+
+@pytest.mark.parametrize("language", sorted(LANGUAGES))
+def test_closest_matches_difflib(language):
+    words = load_term_words()[language]
+    cutoff = LANGUAGES[language].spelling_cutoff
+    index = SpellingIndex(words, cutoff)
+    rng = random.Random(language)
+    for word in words:
+        for variant in perturbed_variants(word, rng):
+            expected = difflib.get_close_matches(variant, words, n=1, cutoff=cutoff)
+            assert index.closest(variant) == (expected[0] if expected else None), variant
+
+
+@pytest.mark.parametrize("language", sorted(LANGUAGES))
+def test_most_similar_matches_difflib(language):
+    words = load_term_words()[language]
+    cutoff = LANGUAGES[language].spelling_cutoff
+    index = SpellingIndex(words, cutoff)
+    rng = random.Random(language)
+    for word in words:
+        for variant in perturbed_variants(word, rng):
+            expected = difflib.get_close_matches(variant, set(words), n=3, cutoff=cutoff)
+            assert [similar for _, similar in index.most_similar(variant, 3)] == expected, variant
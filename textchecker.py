@@ -1,20 +1,33 @@
+import atexit
+import functools
+import threading
+import time
 import json
-from flask import Flask, request, render_template, url_for
+import re
+import click
+from flask import Flask, request, render_template, url_for, jsonify, Response, stream_with_context, g, got_request_exception
 from sqlalchemy import func, desc, select
-import nltk
-from nltk.stem import SnowballStemmer
+from sqlalchemy.exc import OperationalError
 import nh3
-from read_data import insert_data
+from read_data import insert_data, sync_data, format_sync_stats
+from lexicon import get_lexicon, load_lexicons, get_terms_version, refresh_lexicons_if_synced, get_synced_terms_version
+from term_details import load_alternatives, load_offensiveness_counts, invalidate_alternatives, clear_alternatives, alternatives_cache_stats
+from caches import FragmentCache, RelocatableFragment, ResponseCache, modal_id_placeholder
+from corpus import check_corpus
+from benchmark import load_benchmark_terms, generate_corpus, run_benchmark, compare_results, format_results
+from parallel import StemmingPool
+from write_queue import RatingWriteQueue
+from rate_limit import RateLimiter
+from metrics import Metrics, SampledProfiler, count_queries, SIZE_BUCKETS, COUNT_BUCKETS
+from stemming import stemming_stats
 import os
-import numpy as np
-import difflib
-from langdetect import detect
+import sys
+from language_detection import LanguageDetector
+from languages import LANGUAGES, get_language
+from term_search import SEARCH_MODES, create_search_index, refresh_search_index, search_terms
 
 from models import *
 
-# download the punkt nltk dataset that is required for splitting the text
-nltk.download('punkt')
-
 # APP CONFIGURATION 
 class ConfigClass(object):
     """ Flask application config """
@@ -25,16 +38,210 @@ class ConfigClass(object):
     # Flask-SQLAlchemy settings
     SQLALCHEMY_DATABASE_URI = 'sqlite:///sensitive_terms.sqlite'  # File-based SQL database
     SQLALCHEMY_TRACK_MODIFICATIONS = False  # Avoids SQLAlchemy warning
+    # Connections kept open per engine and opened in addition under load, and seconds to wait for a free connection
+    SQLALCHEMY_ENGINE_OPTIONS = {"pool_size": 10, "max_overflow": 10, "pool_timeout": 30}
+
+    # SQLite settings: with WAL rating writes don't block checking texts, the busy timeout (in ms) lets concurrent 
+    # writes wait for each other instead of failing
+    SQLITE_JOURNAL_MODE = 'WAL'
+    SQLITE_BUSY_TIMEOUT = 5000
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+
+    # Whether texts are checked with a separate engine whose connections can only read from the database
+    READ_ONLY_CHECKS = True
+
+    # Seconds between checks whether the terms were synced or the ratings were written by another process
+    TERMS_REFRESH_INTERVAL = 5
+
+    # Whether ratings and reports are written in batches in the background instead of with every request. A batch is written 
+    # when it has RATING_BATCH_SIZE ratings or its first rating waited RATING_FLUSH_INTERVAL seconds
+    ASYNC_RATING_WRITES = True
+    RATING_BATCH_SIZE = 200
+    RATING_FLUSH_INTERVAL = 1.0
+    RATING_QUEUE_SIZE = 10000
+
+    # Number of ratings and reports a client can send per minute on average and at once (per process)
+    RATING_LIMIT_PER_MINUTE = 60
+    RATING_LIMIT_BURST = 20
+
+    # Maximum number of rendered term popups to keep in memory
+    POPUP_CACHE_SIZE = 1000
+
+    # Responses of /submit are reused for the same text and language until the terms or ratings change: at most 
+    # RESPONSE_CACHE_SIZE characters of responses are kept in memory (0 disables the cache), each for RESPONSE_CACHE_TTL seconds.
+    # If RESPONSE_CACHE_DIR is set, the responses are also stored as files in this directory, shared by all processes
+    RESPONSE_CACHE_SIZE = 64 * 1024 * 1024
+    RESPONSE_CACHE_TTL = 3600
+    RESPONSE_CACHE_DIR = None
+
+    # Texts longer than this number of characters are processed in chunks of about STREAM_CHUNK_SIZE characters, 
+    # and the page streams the result of these texts
+    STREAM_MIN_LENGTH = 20000
+    STREAM_CHUNK_SIZE = 5000
+
+    # Maximum number of documents that can be checked with one request to the API
+    API_MAX_DOCUMENTS = 1000
+
+    # Maximum number of terms returned by one request to the term search
+    TERM_SEARCH_MAX_RESULTS = 100
+
+    # Number of worker processes tokenizing and stemming texts of at least PARALLEL_MIN_LENGTH characters in shards of about 
+    # PARALLEL_SHARD_SIZE characters (streamed texts in chunks of STREAM_CHUNK_SIZE characters), 0 checks all texts in the 
+    # process of the request
+    PARALLEL_WORKERS = 0
+    PARALLEL_MIN_LENGTH = 100000
+    PARALLEL_SHARD_SIZE = 20000
+
+    # Whether the lexicons are built and the language profiles are loaded in a background thread at startup, 
+    # /ready tells when this is done
+    WARM_UP_IN_BACKGROUND = True
+
+    # Number of times warming up is tried when it fails (e.g. while the database is locked), waiting WARM_UP_RETRY_DELAY 
+    # seconds before the second try and twice as long before each further one. /ready succeeds after the last try in any case,
+    # what could not be loaded is loaded by the first requests that need it
+    WARM_UP_ATTEMPTS = 5
+    WARM_UP_RETRY_DELAY = 1.0
+
+    # Directory with the nltk data of the punkt tokenizer, searched before the default nltk directories. 
+    # The data is never downloaded at startup, use the download-tokenizer command to install it
+    NLTK_DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'nltk_data')
+
+    # Languages texts can be checked in, out of the languages registered in languages.py
+    SUPPORTED_LANGUAGES = ["english", "german"]
+
+    # Number of characters at the beginning of a text used to detect its language, and number of detected texts to remember
+    LANGUAGE_DETECTION_SAMPLE_SIZE = 2000
+    LANGUAGE_DETECTION_CACHE_SIZE = 1000
+
+    # Whether /metrics shows the metrics of this process in the text format of Prometheus
+    METRICS_ENABLED = True
+
+    # Share of the requests that are profiled with cProfile, and directory the profiles are written to 
+    # (defaults to 'profiles' in the instance folder)
+    PROFILE_SAMPLE_RATE = 0.0
+    PROFILE_DIR = None
 
 
 # CREATE FLASK APP 
 app = Flask(__name__)
 app.config.from_object(__name__ + '.ConfigClass')  
-app.app_context().push()  
+# every setting can be overridden with an environment variable prefixed with TEXTCHECKER_, 
+# e.g. TEXTCHECKER_SQLALCHEMY_DATABASE_URI or TEXTCHECKER_SQLALCHEMY_ENGINE_OPTIONS__pool_size
+app.config.from_prefixed_env("TEXTCHECKER")
+if app.config['READ_ONLY_CHECKS']:
+    # second engine for the same database, used for the queries of checking texts (see execute_read)
+    app.config.setdefault('SQLALCHEMY_BINDS', {}).setdefault(
+        'readonly', dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'], url=app.config['SQLALCHEMY_DATABASE_URI']))
 db.init_app(app)  
-db.create_all()
 
-supported_languages = ["english", "german"]
+supported_languages = [language for language in app.config['SUPPORTED_LANGUAGES'] if language in LANGUAGES]
+
+# rendered popups of the terms, reused until the term or one of its alternatives is rated
+popup_cache = FragmentCache(app.config['POPUP_CACHE_SIZE'])
+
+# whole responses of /submit by the text, language and versions of the terms and ratings
+response_cache = None
+if app.config['RESPONSE_CACHE_SIZE'] > 0:
+    response_cache = ResponseCache(app.config['RESPONSE_CACHE_SIZE'], app.config['RESPONSE_CACHE_TTL'], app.config['RESPONSE_CACHE_DIR'])
+
+def clear_rating_caches():
+    # ratings were written by another process, so any cached popup or ranking may be outdated
+    popup_cache.clear()
+    clear_alternatives()
+
+# notices ratings written by any process, its version is part of the key of cached responses
+ratings_watcher = SyncWatcher('ratings', clear_rating_caches)
+
+# ratings and reports are written in batches by a background thread, and limited per client
+write_queue = None
+if app.config['ASYNC_RATING_WRITES']:
+    # the cached ratings are invalidated after each batch (invalidate_rated_terms is defined below)
+    write_queue = RatingWriteQueue(app, app.config['RATING_BATCH_SIZE'], app.config['RATING_FLUSH_INTERVAL'], app.config['RATING_QUEUE_SIZE'],
+                                   on_flush=lambda reported_ids, rated_ids: invalidate_rated_terms(reported_ids, rated_ids))
+    # write the collected and waiting ratings when the process exits
+    atexit.register(write_queue.close)
+rating_limiter = RateLimiter(app.config['RATING_LIMIT_PER_MINUTE'], app.config['RATING_LIMIT_BURST'])
+
+# the language profiles are loaded when warming up (see warm_up)
+language_detector = LanguageDetector(app.config['LANGUAGE_DETECTION_SAMPLE_SIZE'], app.config['LANGUAGE_DETECTION_CACHE_SIZE'], 
+                                     languages=supported_languages)
+
+# set when the application is warmed up
+warmed_up = threading.Event()
+
+# worker processes for long texts, forked when they are first needed
+stemming_pool = None
+if app.config['PARALLEL_WORKERS'] > 0 and StemmingPool.available():
+    stemming_pool = StemmingPool(app.config['PARALLEL_WORKERS'])
+    atexit.register(stemming_pool.close)
+
+# timers of the stages of checking texts, database queries and requests, shown on /metrics
+metrics = Metrics()
+metrics.describe('textchecker_stage_seconds', 'histogram', 'Seconds taken by each call of a stage of checking texts.')
+metrics.describe('textchecker_request_seconds', 'histogram', 'Seconds taken by requests, without streamed responses.')
+metrics.describe('textchecker_request_size_bytes', 'histogram', 'Size of the request bodies.', SIZE_BUCKETS)
+metrics.describe('textchecker_request_db_queries', 'histogram', 'Number of SQL statements executed per request.', COUNT_BUCKETS)
+metrics.describe('textchecker_requests_total', 'counter', 'Number of requests by endpoint and status.')
+metrics.describe('textchecker_request_errors_total', 'counter', 'Number of requests that failed with an exception.')
+metrics.describe('textchecker_cache_hits_total', 'counter', 'Number of hits of the caches.')
+metrics.describe('textchecker_cache_misses_total', 'counter', 'Number of misses of the caches.')
+metrics.describe('textchecker_cache_entries', 'gauge', 'Number of entries of the caches.')
+metrics.describe('textchecker_rating_writes_total', 'counter', 'Number of ratings written or failed to be written in batches.')
+metrics.describe('textchecker_rating_batches_total', 'counter', 'Number of written batches of ratings.')
+metrics.describe('textchecker_rating_queue_pending', 'gauge', 'Number of ratings waiting to be written.')
+metrics.describe('textchecker_ratings_rejected_total', 'counter', 'Number of ratings rejected by the rate limit.')
+metrics.describe('textchecker_ready', 'gauge', 'Whether the application is warmed up.')
+count_queries(metrics)
+got_request_exception.connect(lambda sender, exception, **extra: metrics.inc('textchecker_request_errors_total', endpoint=request.endpoint or 'unknown',
+                                                                               exception=type(exception).__name__), weak=False)
+
+# a sample of the requests is profiled
+profiler = SampledProfiler(app.config['PROFILE_SAMPLE_RATE'], app.config['PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles'))
+
+def setup_database(attempts=3):
+    """
+    Creates the missing tables and indexes and the search index, and aggregates the ratings of databases created before 
+    the aggregates were maintained. Every process does this at startup, holding a lock so that workers starting at the 
+    same time don't create the same tables. Where the lock is not available, a process that finds a table created by 
+    another one in the meantime checks again. Requires an active Flask application context.
+
+    Parameters:
+    - attempts (int, optional): How often to check again. Defaults to 3.
+
+    Returns:
+    - bool: Whether the term search is available (see create_search_index).
+    """
+    with setup_lock(os.path.join(app.instance_path, 'database-setup.lock')):
+        for attempt in range(attempts):
+            try:
+                db.create_all()
+                # indexes added after the database was created
+                ensure_indexes()
+                break
+            except OperationalError as e:
+                db.session.rollback()
+                if "already exists" not in str(e) or attempt == attempts - 1:
+                    raise
+        # full-text index of the terms for /api/terms/search, kept in sync with the terms (see term_search.py)
+        term_search_available = create_search_index()
+
+        # aggregate the ratings of databases created before the aggregates were maintained
+        if rating_aggregates_missing():
+            backfill_rating_aggregates()
+    return term_search_available
+
+# the database is only used within the application context of a request or command, 
+# for the startup tasks a context is created just for them
+with app.app_context():
+    configure_sqlite(db.engine, app.config['SQLITE_JOURNAL_MODE'], app.config['SQLITE_BUSY_TIMEOUT'], app.config['SQLITE_SYNCHRONOUS'])
+    if 'readonly' in db.engines:
+        configure_sqlite(db.engines['readonly'], busy_timeout=app.config['SQLITE_BUSY_TIMEOUT'], 
+                         synchronous=app.config['SQLITE_SYNCHRONOUS'], query_only=True)
+    term_search_available = setup_database()
+
+# ends of sentences (or lines) at which texts are split if the punkt model is not available, 
+# abbreviations like "S.W.A.N.A." don't end a sentence
+sentence_boundary_pattern = re.compile(r"(?<=\w\w[.!?])\s+|\n")
 
 # Get the directory of the current script
 current_directory = os.path.dirname(os.path.realpath(__file__))
@@ -43,15 +250,152 @@ current_directory = os.path.dirname(os.path.realpath(__file__))
 def initdb_command():
     """Creates the database tables."""
     global db
-    insert_data(db)
+    stats = insert_data(db)
+    print(format_sync_stats(stats))
     print('Initialized the database.')
 
 
+@app.cli.command('sync-terms')
+@click.option('--terms', 'terms_path', type=click.Path(exists=True, dir_okay=False), default='terms.json', show_default=True, help='JSON file with the ids and definitions of the terms.')
+@click.option('--data', 'data_path', type=click.Path(exists=True, dir_okay=False), default='modified_data.json', show_default=True, help='JSON file with the terms and their translations.')
+@click.option('--remove', is_flag=True, help='Delete the terms that are no longer in the files together with their alternatives and ratings.')
+def sync_terms_command(terms_path, data_path, remove):
+    """Applies the changes of the term files to the database, running processes pick them up without a restart."""
+    stats = sync_data(db, terms_path, data_path, remove=remove)
+    print(format_sync_stats(stats))
+
+
+@app.cli.command('download-tokenizer')
+def download_tokenizer_command():
+    """Downloads the punkt tokenizer data into NLTK_DATA_DIR, so it does not have to be downloaded when the app starts."""
+    import nltk
+    if not nltk.download('punkt_tab', download_dir=app.config['NLTK_DATA_DIR']):
+        sys.exit(1)
+
+
+@app.cli.command('backfill-ratings')
+def backfill_ratings_command():
+    """Recomputes the rating aggregates from all stored ratings."""
+    backfill_rating_aggregates()
+    popup_cache.clear()
+    print('Recomputed the rating aggregates.')
+
+
+@app.cli.command('check-corpus')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='File to write the results to as JSON lines, defaults to stdout.')
+@click.option('--workers', '-w', type=int, default=None, help='Number of worker processes, defaults to the number of CPUs.')
+@click.option('--chunk-size', '-c', type=int, default=100, show_default=True, help='Number of documents sent to a worker at once.')
+@click.option('--language', '-l', type=click.Choice(supported_languages), default=None, help='Language of all documents, detected per document if not given.')
+def check_corpus_command(paths, output, workers, chunk_size, language):
+    """Checks JSONL or plain text files for sensitive terms and writes the matches as JSON lines."""
+    # the worker processes are forked from this one, wait for the lexicons instead of forking while they are built
+    if warm_up_thread is not None:
+        warm_up_thread.join()
+    checked = check_corpus(paths, output, workers, chunk_size, language)
+    print('Checked {} documents.'.format(checked), file=sys.stderr)
+
+
+@app.cli.command('benchmark')
+@click.option('--language', '-l', 'languages', multiple=True, type=click.Choice(supported_languages), help='Language of the texts, can be given more than once, defaults to all languages.')
+@click.option('--lengths', default='500,5000,20000', show_default=True, help='Comma separated lengths of the texts in characters.')
+@click.option('--densities', default='0.01,0.05', show_default=True, help='Comma separated shares of the words that are sensitive terms.')
+@click.option('--count', '-n', type=int, default=3, show_default=True, help='Number of texts of each language, length and density.')
+@click.option('--repeat', '-r', type=int, default=5, show_default=True, help='Number of times each text is checked.')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed of the generated texts.')
+@click.option('--data', 'data_path', default='modified_data.json', show_default=True, type=click.Path(exists=True, dir_okay=False), help='File with the terms inserted into the texts.')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default=None, help='File to write the results to as JSON.')
+@click.option('--compare', 'previous', type=click.File('r', encoding='utf-8'), default=None, help='Results of a previous run to compare with.')
+@click.option('--threshold', type=float, default=0.1, show_default=True, help='Share by which a stage has to be slower to count as a regression.')
+def benchmark_command(languages, lengths, densities, count, repeat, seed, data_path, output, previous, threshold):
+    """Measures each stage of checking generated texts and compares the results with a previous run."""
+    if warm_up_thread is not None:
+        warm_up_thread.join()
+    corpus = generate_corpus(load_benchmark_terms(data_path), languages or supported_languages,
+                             [int(length) for length in lengths.split(',')], [float(density) for density in densities.split(',')], count, seed)
+    # the popups link to the rating routes, which needs a request context
+    with app.test_request_context():
+        results = run_benchmark(corpus, repeat)
+    print('Median milliseconds per stage:')
+    print('\n'.join(format_results(results)))
+    if output is not None:
+        json.dump(results, output, indent=2)
+    if previous is not None:
+        lines, regressions = compare_results(json.load(previous), results, threshold)
+        print('\n'.join(lines))
+        print('{} stages became slower by more than {:.0%}.'.format(regressions, threshold))
+        if regressions:
+            sys.exit(1)
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """ Tells whether the application is warmed up, e.g. for the readiness check of a load balancer. """
+    if warmed_up.is_set():
+        return jsonify({"ready": True})
+    return jsonify({"ready": False}), 503
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.db_queries = 0
+    g.profile = profiler.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    profiler.stop(g.pop('profile', None), endpoint)
+    metrics.observe('textchecker_request_seconds', time.perf_counter() - g.request_start, endpoint=endpoint)
+    metrics.observe('textchecker_request_size_bytes', request.content_length or 0, endpoint=endpoint)
+    metrics.observe('textchecker_request_db_queries', g.db_queries, endpoint=endpoint)
+    metrics.inc('textchecker_requests_total', endpoint=endpoint, status=response.status_code)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def show_metrics():
+    """ Shows the metrics of this process in the text format of Prometheus. """
+    if not app.config['METRICS_ENABLED']:
+        return "Metrics are disabled", 404
+
+    # the statistics of the caches and of the rating writes are read when the metrics are requested
+    caches = {"popup": popup_cache.stats(), "alternatives": alternatives_cache_stats(), "language": language_detector.cache.stats()}
+    if response_cache is not None:
+        caches["response"] = response_cache.stats()
+    for language, stats in stemming_stats().items():
+        caches["stem_" + language] = stats
+    samples = [("textchecker_ready", {}, warmed_up.is_set()),
+               ("textchecker_ratings_rejected_total", {}, rating_limiter.rejected)]
+    for cache, stats in caches.items():
+        samples += [("textchecker_cache_hits_total", {"cache": cache}, stats["hits"]),
+                    ("textchecker_cache_misses_total", {"cache": cache}, stats["misses"]),
+                    ("textchecker_cache_entries", {"cache": cache}, stats["size"])]
+    if write_queue is not None:
+        stats = write_queue.stats()
+        samples += [("textchecker_rating_writes_total", {"result": "written"}, stats["written"]),
+                    ("textchecker_rating_writes_total", {"result": "failed"}, stats["failed"]),
+                    ("textchecker_rating_batches_total", {}, stats["batches"]),
+                    ("textchecker_rating_queue_pending", {}, stats["pending"])]
+    return Response(metrics.render(samples), mimetype='text/plain; version=0.0.4')
+
+
+@app.before_request
+def refresh_synced_data():
+    # pick up terms synced and ratings written by other processes
+    refresh_lexicons_if_synced(app.config['TERMS_REFRESH_INTERVAL'])
+    ratings_watcher.check(app.config['TERMS_REFRESH_INTERVAL'])
+
+
 # Home page
 @app.route('/', methods=['GET'])
 def home():
     # render home.html template
-    return render_template("home.html")
+    # with batched writes the text is checked again after the rating was written
+    rating_refresh_delay = int(app.config['RATING_FLUSH_INTERVAL'] * 1000) + 200 if write_queue is not None else 0
+    return render_template("home.html", stream_min_length=app.config['STREAM_MIN_LENGTH'], rating_refresh_delay=rating_refresh_delay,
+                           languages=[get_language(language) for language in supported_languages])
 
 
 @app.route('/submit', methods=['POST'])
@@ -61,6 +405,14 @@ def submit():
     language = request.form.get('language', 'auto') # Default to auto-detect
     detected = 0
 
+    # identical texts are only checked again when the terms or ratings changed
+    cache_key = None
+    if response_cache is not None:
+        cache_key = response_cache.make_key(user_text, language, get_synced_terms_version(), ratings_watcher.version)
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            return cached_response
+
     if language == 'auto':
         detected = 1
         language = auto_detect_language(user_text)
@@ -69,14 +421,20 @@ def submit():
         # sanitize input
         clean_text = nh3.clean(user_text)
 
-        # Find sensitive terms in the user text
-        indices, terms, split_text = find_sensitive_terms(clean_text, language)
+        if len(clean_text) > app.config['STREAM_MIN_LENGTH']:
+            # process long texts chunk by chunk to keep only a few chunks in memory at a time
+            segments = list(stream_marked_html(clean_text, language, app.config['STREAM_CHUNK_SIZE']))
+            marked_html = "".join(html for html, _ in segments)
+            modals = "".join(modals for _, modals in segments)
+        else:
+            # Find sensitive terms in the user text
+            indices, terms, split_text, spans = find_sensitive_terms(clean_text, language, return_spans=True)
 
-        # create corresponding HTML that will be inserted in the displayed page
-        marked_html, modals = create_marked_html(clean_text, split_text, indices, terms, language)
+            # create corresponding HTML that will be inserted in the displayed page
+            marked_html, modals = create_marked_html(clean_text, split_text, indices, terms, language, spans)
 
         # create dictionary with the textarea template and the modals
-        result = {"textarea": render_template("textarea.html", user_text=clean_text, indices=indices, terms=terms, marked_html=marked_html), 
+        result = {"textarea": render_template("textarea.html", user_text=clean_text, marked_html=marked_html), 
                 "modals": modals,
                 "detected": detected,
                 "language": language.capitalize()}
@@ -88,29 +446,51 @@ def submit():
                 "language": language.capitalize()}
     
     # return the result dictionary as json
-    return json.dumps(result)
+    response = json.dumps(result)
+    if cache_key is not None:
+        response_cache.put(cache_key, response)
+    return response
+
+@app.route('/submit/stream', methods=['POST'])
+def submit_stream():
+    """
+    Checks the text like /submit, but streams the result while the text is processed chunk by chunk, as one JSON object per line. 
+    The first line contains the textarea template without marks, the language and whether it was detected, each following line 
+    the marked 'html' and the 'modals' of a segment of the text, to be appended to the highlights and modals of the page.
+    """
+    user_text = request.form.get('user_text', '')
+    language = request.form.get('language', 'auto') # Default to auto-detect
+    detected = 0
 
+    if language == 'auto':
+        detected = 1
+        language = auto_detect_language(user_text)
+
+    def generate():
+        if user_text.strip() and language in supported_languages:
+            clean_text = nh3.clean(user_text)
+            yield json.dumps({"textarea": render_template("textarea.html", user_text=clean_text, marked_html=""),
+                              "detected": detected, "language": language.capitalize()}) + "\n"
+            for marked_html, modals in stream_marked_html(clean_text, language, app.config['STREAM_CHUNK_SIZE']):
+                yield json.dumps({"html": marked_html, "modals": modals}) + "\n"
+        else:
+            yield json.dumps({"textarea": render_template("textarea.html", user_text=user_text), 
+                              "detected": detected, "language": language.capitalize()}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@metrics.timed('detect')
 def auto_detect_language(text): #[TODO] shouldn't this return German even if there was an error? Otherwise we have to check for 'unknown' or it will lead to errors in the other functions
     """
-    Detects the language of the given text.
+    Detects the language of the given text, using only the beginning of long texts (see LanguageDetector).
     Parameters:
     - text (str): The text for which the language needs to be detected.
     Returns:
     - str: The detected language ('english', 'german', or 'unknown').
     """
-    try:
-        language_code = detect(text)
-        if language_code == 'en':
-            return 'english'
-        elif language_code == 'de':
-            return 'german'
-        else:
-            return 'german'  # Default to German if language cannot be detected or is not one of the supported languages
-    except Exception as e:
-        print(f"Error detecting language: {e}")
-        return 'unknown'
+    return language_detector.detect(text)
 
-def find_sensitive_terms(text, language='german'):
+def find_sensitive_terms(text, language='german', return_spans=False):
     """
     Identify and extract sensitive terms from the given text using stemming and matching of similar words to account for different spellings.
     
@@ -121,91 +501,44 @@ def find_sensitive_terms(text, language='german'):
     Parameters:
     - text (str): The text to be analyzed for sensitive terms.
     - language (str, optional): The language used for stemming. Defaults to 'german'.
+    - return_spans (bool, optional): Whether to also return the character offsets of the segments. Defaults to False.
     
     Returns:
     - tuple: A tuple containing three elements:
         1. A list of indices where sensitive terms start in the original text.
-        2. A list of sensitive term objects that were matched.
+        2. A list of the records of the sensitive terms that were matched (see TermRecord in lexicon.py).
         3. The original text split into segments, with sensitive terms isolated.
+      If return_spans is True, a fourth element contains a (start, end) tuple of character offsets in the text for each segment.
     """
-    # Initialize the stemmer for the specified language
-    stemmer = SnowballStemmer(language)
-
-    # Tokenize and stem the input text
-    words = nltk.word_tokenize(text)
-    words_lower = [word.lower() for word in words] # Lowercase all words for consistent matching
-    stemmed_words = [stemmer.stem(word) for word in words_lower]
-   
-    
-    # Fetch predefined sensitive terms from the database, sorted by their length (descending)
-    terms = Term.query.filter().all()
-    sorted_terms = sorted(terms, key=lambda t: len(t.term.split()), reverse=True)
-
-    split_sorted_terms = [term.term.split(" ") for term in sorted_terms]
-    t  = []
-    for terms in split_sorted_terms:
-        for term in terms:
-            t.append(term)
-    split_sorted_terms = t
-    
-    matched_terms_details = [] # To store details of matched terms
-    covered_indices = set()  # Track indices in the text that are already covered by a match
-
-    # check for different spellings by correcting words close to the listed ones before checking
-    new_stemmed_words = []
-    for word in stemmed_words:
-        close_matches = difflib.get_close_matches(word, split_sorted_terms, n=1, cutoff=0.8)
-        if close_matches:
-            new_stemmed_words.append(stemmer.stem(close_matches[0].lower()))
-        else:
-            new_stemmed_words.append(word)
-
-    stemmed_words = new_stemmed_words
-    stemmed_text = " ".join(stemmed_words) # Rejoin the stemmed words into a single string
-    stemmed_text = " " + stemmed_text
-    
-    # Iterate over each term to find matches in the stemmed text
-    for term in sorted_terms:
+    # Tokenize the input text and find the sensitive terms in the words
+    if use_stemming_pool(text):
+        # long texts are tokenized and stemmed in shards by the worker processes, the terms are matched in all words at once
+        words, spans, stemmed_words = [], [], []
+        for offset, shard_words, shard_spans, shard_stems in iter_stemmed_chunks(text, language, app.config['PARALLEL_SHARD_SIZE']):
+            words.extend(shard_words)
+            spans.extend((start + offset, end + offset) for start, end in shard_spans)
+            stemmed_words.extend(shard_stems)
+        matched_terms_details = match_stemmed_words(stemmed_words, get_lexicon(language))
+    else:
+        words, spans = tokenize_with_spans(text, language)
+        matched_terms_details = match_sensitive_terms(words, language)
 
-        stemmed_term = " ".join([stemmer.stem(word) for word in term.term.split()])
-
-        if stemmed_term == "":
-            print("empty stem term", term.term)
-            # if there is no stem we don't have to search for it, just move on to the next term
-            continue
-        
-        # Find all occurrences of the stemmed term in the stemmed text
-        start_pos = 0
-        while True:
-            term_index = stemmed_text.find(" "+stemmed_term, start_pos)
-            if term_index == -1:
-                break # Exit the loop if no more occurrences are found
-            # Calculate the start and end word indices in the original text
-            word_index = len(stemmed_text[:term_index].split())
-            end_word_index = word_index + len(stemmed_term.split())
-
-            # Append matched term details if it doesn't overlap with previously covered indices
-            if not any(index in covered_indices for index in range(word_index, end_word_index)):
-                matched_terms_details.append((word_index, end_word_index, term))
-                # Mark indices as covered
-                covered_indices.update(range(word_index, end_word_index))
-
-            # Prepare for the next search iteration
-            start_pos = term_index + len(stemmed_term)  # Update start_pos to search for next occurrence
-    
-    # Sort matched terms by their starting index for proper ordering
-    matched_terms_details.sort(key=lambda x: x[0])
+    # Look up the records of the matched terms in the lexicon, skipping terms removed since they were matched
+    records = get_lexicon(language).records
+    matched_terms_details = [(start, end, records[term_id]) for start, end, term_id in matched_terms_details if term_id in records]
 
     # Reconstruct the text, isolating sensitive terms and recording their indices
-    split_text, sensitive_indices, sensitive_terms = [], [], []
+    split_text, split_spans, sensitive_indices, sensitive_terms = [], [], [], []
     last_index = 0 # Track the last processed index
     reduce_index_by = 0 # Adjustment for indices due to joining terms
 
     for start_index, end_index, term in matched_terms_details:
         # Add non-sensitive segments of the text
         split_text.extend(words[last_index:start_index])
+        split_spans.extend(spans[last_index:start_index])
         # Add the matched sensitive term
         split_text.append(" ".join(words[start_index:end_index]))
+        split_spans.append((spans[start_index][0], spans[end_index-1][1]))
         # Record the index of the sensitive term
         sensitive_indices.append(start_index-reduce_index_by)
         sensitive_terms.append(term)
@@ -214,27 +547,238 @@ def find_sensitive_terms(text, language='german'):
 
     # Add any remaining text after the last matched term
     split_text.extend(words[last_index:])
+    split_spans.extend(spans[last_index:])
     
+    if return_spans:
+        return sensitive_indices, sensitive_terms, split_text, split_spans
     return sensitive_indices, sensitive_terms, split_text
 
-def create_marked_html(text, split_text, term_indices, terms, language='german'):
+@metrics.timed('tokenize')
+def tokenize_with_spans(text, language='english'):
+    """
+    Splits the text into words and finds the character offsets of the words in the text.
+
+    Parameters:
+    - text (str): The text to tokenize.
+    - language (str, optional): The language of the text, its sentences are split with the punkt model of the language. Defaults to 'english'.
+
+    Returns:
+    - list: The words of the text as returned by the tokenizer.
+    - list: A (start, end) tuple of character offsets in the text for each word (see align_tokens).
+    """
+    import nltk
+    tokenizer_language = get_language(language).tokenizer_language
+    if load_sentence_tokenizer(tokenizer_language) is None:
+        # without the punkt model the sentences are split at punctuation (see iter_sentence_spans) 
+        words = [word for start, end in iter_sentence_spans(text, language) for word in nltk.word_tokenize(text[start:end], preserve_line=True)]
+    else:
+        words = nltk.word_tokenize(text, tokenizer_language)
+    return words, align_tokens(text, words)
+
+def match_sensitive_terms(words, language='german'):
+    """
+    Finds the sensitive terms in the tokenized words of a text (see find_sensitive_terms).
+
+    Parameters:
+    - words (list): The words of the text as returned by the tokenizer.
+    - language (str, optional): The language used for stemming. Defaults to 'german'.
+
+    Returns:
+    - list: Tuples of (start word index, end word index, term id) of the matched terms, sorted by their start index.
+    """
+    # Get the predefined sensitive terms, already stemmed and sorted by their length (descending)
+    lexicon = get_lexicon(language)
+
+    # Find all occurrences of the terms in the stemmed words
+    return match_stemmed_words(stem_words(words, lexicon), lexicon)
+
+def match_stemmed_words(stemmed_words, lexicon):
+    """ Finds the terms of the lexicon in the stemmed words (see stem_words), returns the matches like match_sensitive_terms. """
+    start = time.perf_counter()
+    matches = lexicon.find_matches(stemmed_words)
+    metrics.observe('textchecker_stage_seconds', time.perf_counter() - start, stage='match')
+    return matches
+
+def stem_words(words, lexicon):
+    """
+    Stems the tokenized words of a text for matching them with the terms of the lexicon.
+
+    Parameters:
+    - words (list): The words of the text as returned by the tokenizer.
+    - lexicon (Lexicon): The lexicon of the language of the text.
+
+    Returns:
+    - list: The stemmed (and lowercased) words, with different spellings corrected to the words of the terms.
+    """
+    # Stem the words, lowercase all words for consistent matching
+    start = time.perf_counter()
+    stemmed_words = [lexicon.stemmer.stem(word.lower()) for word in words]
+    metrics.observe('textchecker_stage_seconds', time.perf_counter() - start, stage='stem')
+    
+    # check for different spellings by correcting words close to the listed ones before checking
+    start = time.perf_counter()
+    corrected_words = [lexicon.correct_spelling(word) for word in stemmed_words]
+    metrics.observe('textchecker_stage_seconds', time.perf_counter() - start, stage='correct')
+    return corrected_words
+
+def align_tokens(text, words):
+    """
+    Finds the character offsets of the tokenized words in the text they were tokenized from.
+
+    Parameters:
+    - text (str): The text that was tokenized.
+    - words (list): The words of the text as returned by the tokenizer.
+
+    Returns:
+    - list: A (start, end) tuple of character offsets for each word, such that text[start:end] is the word as written in the text.
+    """
+    spans = []
+    position = 0
+    for word in words:
+        start = text.find(word, position)
+        length = len(word)
+        if word in ("``", "''"):
+            # the tokenizer replaces double quotes by `` or ''
+            quote = text.find('"', position)
+            if quote != -1 and (start == -1 or quote < start):
+                start, length = quote, 1
+        if start == -1:
+            # this should never happen, keep the position so the following words can still be found
+            print("Warning: word '{}' could not be found in text".format(word))
+            start, length = position, 0
+        spans.append((start, start + length))
+        position = start + length
+    return spans
+
+def check_documents(documents):
+    """
+    Finds the sensitive terms in several documents without creating any HTML, loading the details of all matched terms at once.
+
+    Parameters:
+    - documents (list): Dictionaries with the 'text' of each document and optionally its 'language' (one of the supported 
+      languages or 'auto', the default) and an 'id' that is returned with the result.
+
+    Returns:
+    - list: A dictionary for each document with the 'language' that was used, whether the language was 'detected' and the 
+      'matches', which contain the word ('token_start', 'token_end') and character ('start', 'end') offsets, the 'text' 
+      and the 'term' that was matched together with its 'offensiveness_count' and 'alternatives' ordered by their rating.
+    """
+    results = []
+    for document in documents:
+        text = document.get("text") or ""
+        language = document.get("language") or "auto"
+        detected = language == "auto"
+        if detected:
+            language = auto_detect_language(text)
+
+        result = {"language": language, "detected": detected, "matches": []}
+        if "id" in document:
+            result["id"] = document["id"]
+
+        # only process if there is text and it is in one of the supported languages
+        if text.strip() and language in supported_languages:
+            words, spans = tokenize_with_spans(text, language)
+            records = get_lexicon(language).records
+            for start, end, term_id in match_sensitive_terms(words, language):
+                if term_id not in records:
+                    # the term was removed since it was matched
+                    continue
+                result["matches"].append({"token_start": start, "token_end": end,
+                                          "start": spans[start][0], "end": spans[end-1][1],
+                                          "text": text[spans[start][0]:spans[end-1][1]],
+                                          "term": records[term_id]})
+        results.append(result)
+
+    # load the alternatives and ratings of the matched terms of all documents at once
+    term_ids = set(match["term"].id for result in results for match in result["matches"])
+    alternatives = load_alternatives(term_ids)
+    offensiveness_counts = load_offensiveness_counts(term_ids)
+
+    for result in results:
+        for match in result["matches"]:
+            term = match["term"]
+            # the alternatives are ordered by their average rating, unrated alternatives count as the middle value
+            ranked = alternatives[term.id]
+            match["term"] = {"id": term.id, "term": term.term, "description": term.description, "language": term.language}
+            match["offensiveness_count"] = offensiveness_counts[term.id]
+            match["alternatives"] = [{"id": alternative.id, "term": alternative.term, "average_rating": average, 
+                                      "rating_count": alternative.rating_count or 0} for alternative, average in ranked]
+    return results
+
+@app.route('/api/check', methods=['POST'])
+def api_check():
+    """
+    Checks a batch of documents for sensitive terms and returns the matches as JSON instead of HTML.
+
+    Expects a JSON body with a list of 'documents', each either a string or an object with the 'text' and optionally the 
+    'language' and an 'id' (see check_documents). Returns an object with the list of 'results' in the same order.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        return "No JSON body provided", 400
+    documents = data.get("documents") if isinstance(data, dict) else data
+    if not isinstance(documents, list):
+        return "No list of documents provided", 400
+    if len(documents) > app.config['API_MAX_DOCUMENTS']:
+        return "Too many documents provided, at most {} can be checked at once".format(app.config['API_MAX_DOCUMENTS']), 413
+
+    # allow plain strings as documents
+    documents = [{"text": document} if isinstance(document, str) else document for document in documents]
+    for document in documents:
+        if not isinstance(document, dict) or not isinstance(document.get("text", ""), str):
+            return "Malformed document provided", 400
+        # a missing or null language is detected, like in check_documents
+        if (document.get("language") or "auto") not in supported_languages + ["auto"]:
+            return "Not a supported language", 400
+
+    return jsonify({"results": check_documents(documents)})
+
+@app.route('/api/terms/search', methods=['GET'])
+def api_search_terms():
+    """
+    Searches the sensitive terms, e.g. for editors and integrations.
+
+    Expects the search text as the query parameter 'q' and optionally the 'mode' ('prefix' (default), 'stem', 'text' or 'fuzzy', 
+    see search_terms in term_search.py), the 'language' of the terms (all supported languages by default) and the maximum 
+    number of results ('limit', 20 by default). Returns an object with the list of found terms as 'results', the best match first.
+    """
+    query = request.args.get("q", "")
+    mode = request.args.get("mode", "prefix")
+    language = request.args.get("language") or None
+    if not query.strip():
+        return "No search text provided", 400
+    if mode not in SEARCH_MODES:
+        return "Not a supported search mode", 400
+    if language is not None and language not in supported_languages:
+        return "Not a supported language", 400
+    limit = request.args.get("limit", 20, type=int)
+    limit = max(1, min(limit, app.config['TERM_SEARCH_MAX_RESULTS']))
+    # only the fuzzy search works without the full-text index
+    if mode != "fuzzy" and not term_search_available:
+        return "The term search is not available", 503
+
+    records = search_terms(query, mode, [language] if language else supported_languages, limit)
+    return jsonify({"results": [{"id": record.id, "term": record.term, "description": record.description, 
+                                 "language": record.language} for record in records]})
+
+def create_marked_html(text, split_text, term_indices, terms, language='german', spans=None):
     """
     Creates HTML of the text with the terms at the supplied indices marked, as well as for the popups of the corresponding terms. 
+    The HTML is built in a single pass by joining slices of the text between the character offsets of the segments.
 
     arguments:
         text (str): The complete text in which to mark terms as one string. The marked text will match the white space of this text. 
         split_text (list): List of strings (words) from the text, can be turned into the text by appending with corresponding white space in between each list element. 
         term_indices (list): List of integers indicating the indices of the sensitive terms within the split_text list that are to be marked
-        terms (list): List of term objects, containing the terms that are to be marks in the order they appear in the text. Needs to be of the same length as term_indices. 
+        terms (list): List of term records (see TermRecord in lexicon.py), containing the terms that are to be marks in the order they appear in the text. Needs to be of the same length as term_indices. 
         language (str): Optional parameter indicating the language of the text, should be one of the supported languages ('english' or 'german'). Defaults to 'german'. 
+        spans (list): Optional list of (start, end) character offsets of each element of split_text in the text, as returned by find_sensitive_terms. 
+            They are computed from split_text if not given, which only works if the words of the marked terms are separated by single spaces in the text.
 
     returns:
         marked_html: HTML containing the text in the format needed to display it with highlights, including the popups with detailed information of each terms and alternatives. 
+        modals: HTML of the modals to rate or report the marked terms and their alternatives.
     """
-
-    # if there are no terms to mark return None
-    if len(term_indices) == 0:
-        return None
     
     # if term_indices and terms do not have the same length, find common length and work with that
     if len(term_indices)<len(terms):
@@ -244,81 +788,227 @@ def create_marked_html(text, split_text, term_indices, terms, language='german')
         term_indices=term_indices[:len(terms)]
         print("Warning: term_indices and terms do not have the same length, not all terms may be marked")
 
-    marked_html = ""
-    span = "{}"
+    if spans is None:
+        spans = align_tokens(text, split_text)
+
+    marks = [(spans[index][0], spans[index][1], term) for index, term in zip(term_indices, terms)]
+    marked_html, modals, _ = render_marks(text, marks, language)
+
+    # add the rest of the text up to the last word
+    position = marks[-1][1] if marks else 0
+    text_end = spans[-1][1] if spans else 0
+    marked_html.append(text[position:max(position, text_end)])
+
+    return "".join(marked_html), modals
+
+@metrics.timed('render')
+def render_marks(text, marks, language='german', position=0, next_modal_id=0):
+    """
+    Creates the HTML of a part of the text with the given terms marked, and of the popups and modals of the terms.
+
+    arguments:
+        text (str): The complete text.
+        marks (list): Tuples of (start, end, term record) with the character offsets of the terms to mark, in the order they appear in the text.
+        language (str): Optional language of the text, one of the supported languages. Defaults to 'german'.
+        position (int): Optional offset in the text from which on the HTML is created. Defaults to 0.
+        next_modal_id (int): Optional id of the first modal. Defaults to 0.
+
+    returns:
+        marked_html: List of HTML strings of the text from the position up to the end of the last term.
+        modals: HTML of the modals to rate or report the marked terms and their alternatives.
+        next_modal_id: The id of the modal following the last modal.
+    """
     highlight= "<mark  class='popup' style=\"background-color:{color};\">{}{}</mark>"
-    indices = term_indices.copy()
-    text_to_add = ""
-    next_marked = indices.pop(0)
-    term_index = 0
-    text_should_be_marked = True if next_marked==0 else False
-    next_modal_id = 0
     modals = ""
+    terms = [term for _, _, term in marks]
+
+    # load the ratings of all terms at once, and the alternatives of the terms whose popups are not cached. Popups rendered
+    # from alternatives that are rated while they are loaded are not cached
+    generation = popup_cache.generation()
+    offensiveness_counts = load_offensiveness_counts(term.id for term in terms)
+    uncached_ids = [term.id for term in terms if (term.id, language, get_terms_version()) not in popup_cache]
+    alternatives = load_alternatives(uncached_ids)
+
+    marked_html = []
+    for start, end, term in marks:
+        # create the popup for the term
+        term_details = {"alternatives": alternatives[term.id]} if term.id in alternatives else None
+        popups, new_modals, next_modal_id = create_popup_html(term, language, next_modal_id, term_details, generation)
+        modals += new_modals
+
+        # get offensiveness rating which determines the color of the highlight
+        o_ratings = offensiveness_counts[term.id]
+        color = "var(--green)"
+        if o_ratings > 3: # TODO decide on proper cutoff values
+            color = "var(--orange)"
+        if o_ratings > 4:
+            color = "var(--red)"
+
+        # add the unmarked text before the term and the marked term
+        marked_html.append(text[position:start])
+        marked_html.append(highlight.format(text[start:end], popups, color=color))
+        position = end
+
+    return marked_html, modals, next_modal_id
+
+@functools.lru_cache(maxsize=None)
+def load_sentence_tokenizer(language="english"):
+    """ Returns the punkt sentence tokenizer used by nltk.word_tokenize, or None if the punkt model is not available. """
+    import nltk
+    from nltk.tokenize.punkt import PunktTokenizer
+
+    # prefer the data installed with the app (see download-tokenizer)
+    if app.config['NLTK_DATA_DIR'] not in nltk.data.path:
+        nltk.data.path.insert(0, app.config['NLTK_DATA_DIR'])
+    try:
+        return PunktTokenizer(language)
+    except LookupError:
+        print("Warning: the punkt tokenizer data was not found, sentences are split at punctuation instead. "
+              "Install it with `flask --app textchecker.py download-tokenizer`.")
+        return None
 
+def iter_sentence_spans(text, language='english'):
+    """
+    Yields the (start, end) character offsets of the sentences of the text in the given language, split the same way 
+    nltk.word_tokenize splits them. If the punkt model is not available, the text is split at the ends of sentences and lines instead.
+    """
+    tokenizer = load_sentence_tokenizer(get_language(language).tokenizer_language)
+    if tokenizer is not None:
+        yield from tokenizer.span_tokenize(text)
+        return
+    position = 0
+    for boundary in sentence_boundary_pattern.finditer(text):
+        yield position, boundary.start()
+        position = boundary.end()
+    yield position, len(text)
+
+def iter_text_chunks(text, chunk_size=5000, language='english'):
+    """
+    Splits a text into chunks of whole sentences with about the given number of characters, so that the chunks can be 
+    tokenized one at a time into the same words as the whole text.
 
-    for i,word in enumerate(split_text):
-        # find the word in the text string, and get the previous whitespace
-        next_word_index = text.find(word)
+    Parameters:
+    - text (str): The text to split.
+    - chunk_size (int, optional): The minimum number of characters of a chunk, except for the last one. Defaults to 5000.
+    - language (str, optional): The language of the text. Defaults to 'english'.
 
-        # if the word isn't in the text print warning and stop marking terms, this should never happen with correct text and split_text inputs
-        if next_word_index == -1:
-            print("Warning: word '{}' from split_text could not be found in text, will not mark any further terms".format(word))
-            break
+    Yields:
+    - tuple: The character offset of the chunk in the text and the chunk.
+    """
+    offset = 0
+    for _, end in iter_sentence_spans(text, language):
+        if end - offset >= chunk_size:
+            yield offset, text[offset:end]
+            offset = end
+    if offset < len(text):
+        yield offset, text[offset:]
+
+def use_stemming_pool(text):
+    """ Returns whether the text is long enough to be tokenized and stemmed by the worker processes, if there are any. """
+    return stemming_pool is not None and len(text) >= app.config['PARALLEL_MIN_LENGTH']
+
+def iter_stemmed_chunks(text, language='german', chunk_size=5000):
+    """
+    Tokenizes and stems a text chunk by chunk (see iter_text_chunks), in the worker processes if the text is long enough 
+    (see use_stemming_pool).
 
-        whitespace = text[:next_word_index]
-        # remove the whitespace and word from the text to search for next time
-        text = text[next_word_index+len(word):]
-
-        # add to the text until text should be marked changes
-        word =  "\"" if word == "``" else word # TODO change this in the future to not be hardcoded
-        text_to_add += whitespace + word
-
-        if next_marked!=-1 and i+1>next_marked:
-            # get the next marked index if the current one has been passed
-            next_marked = indices.pop(0) if len(indices)>0 else -1
-
-        if next_marked == i+1 and not text_should_be_marked and text_to_add:
-            # the current text should not be marked but the next mark should start at the next index, so this chunk needs to be finished
-            # create a span with the current text
-            marked_html += span.format(text_to_add)
-            text_to_add = ""
-            # get the next index of marked text and remember that the next term(s) should be marked
-            next_marked = indices.pop(0) if len(indices)>0 else -1
-            text_should_be_marked = True
-
-        elif text_should_be_marked: # mark each term that is to be marked
-            # create the popup for the term
-            popups, new_modals, next_modal_id = create_popup_html(terms[term_index], language, next_modal_id)
-            modals += new_modals
-
-            # get offensiveness rating which determines the color of the highlight
-            o_ratings = len(OffensivenessRating.query.filter(OffensivenessRating.term_id==terms[term_index].id).all())
-            color = "var(--green)"
-            if o_ratings > 3: # TODO decide on proper cutoff values
-                color = "var(--orange)"
-            if o_ratings > 4:
-                color = "var(--red)"
-        
-            marked_html += whitespace + highlight.format(text_to_add.lstrip(), popups, color=color)
-            term_index += 1
-            text_to_add = ""
+    Parameters:
+    - text (str): The text to tokenize and stem.
+    - language (str, optional): The language used for stemming. Defaults to 'german'.
+    - chunk_size (int, optional): The minimum number of characters of a chunk. Defaults to 5000.
 
-            # reset if the next index should be marked
-            if next_marked == i+1:
-                text_should_be_marked = True
-            else:
-                text_should_be_marked = False
+    Yields:
+    - tuple: The character offset of each chunk in the text, its words, the (start, end) character offsets of the words 
+      in the chunk and the stemmed words (see stem_words), in the order of the chunks.
+    """
+    lexicon = get_lexicon(language)
+    if use_stemming_pool(text):
+        # the workers are forked with the current lexicons and the loaded tokenizers
+        for name in supported_languages:
+            load_sentence_tokenizer(get_language(name).tokenizer_language)
+        lexicons = {name: get_lexicon(name) for name in supported_languages}
+        yield from stemming_pool.map_shards(lexicons, language, iter_text_chunks(text, chunk_size, language))
+        return
+
+    for offset, chunk in iter_text_chunks(text, chunk_size, language):
+        words, spans = tokenize_with_spans(chunk, language)
+        yield offset, words, spans, stem_words(words, lexicon)
+
+def iter_matched_segments(text, language='german', chunk_size=5000):
+    """
+    Finds the sensitive terms in a text chunk by chunk (see iter_text_chunks), so that only the words of a few chunks are 
+    held in memory at a time. Terms spanning several chunks are found, the matches are the same as those of find_sensitive_terms.
 
-    # add the last part of the text if there is something to add
-    if text_should_be_marked and text_to_add:
-        marked_html += whitespace + highlight.format(text_to_add.lstrip(), popups, color=color)
-    elif text_to_add:
-        marked_html += span.format(text_to_add.rstrip())
+    The words of a chunk are kept until the matches in them can't be affected by the following words anymore, which is 
+    the case at the first word index no term occurrence spans.
 
-    return marked_html, modals
+    Parameters:
+    - text (str): The text to be analyzed for sensitive terms.
+    - language (str, optional): The language used for stemming. Defaults to 'german'.
+    - chunk_size (int, optional): The minimum number of characters of a chunk. Defaults to 5000.
+
+    Yields:
+    - tuple: The (start, end) character offsets of the last word of a segment of the text and the (start, end, term id) 
+      tuples with the character offsets of the terms matched in the segment. The segments follow each other without gaps.
+    """
+    lexicon = get_lexicon(language)
+    spans, stemmed_words = [], []
+    for offset, _, chunk_spans, chunk_stems in iter_stemmed_chunks(text, language, chunk_size):
+        # add the tokenized and stemmed words of the chunk to those kept from previous chunks
+        spans.extend((start + offset, end + offset) for start, end in chunk_spans)
+        stemmed_words.extend(chunk_stems)
+
+        # occurrences starting at or after the limit may continue in the next chunk
+        start = time.perf_counter()
+        candidates = lexicon.find_candidates(stemmed_words)
+        limit = min(len(stemmed_words), len(stemmed_words) - lexicon.max_words + 1)
+        cut = lexicon.last_independent_index(candidates, limit) if limit > 0 else 0
+        matches = lexicon.resolve_candidates([candidate for candidate in candidates if candidate[2] <= cut]) if cut else []
+        metrics.observe('textchecker_stage_seconds', time.perf_counter() - start, stage='match')
+        if cut == 0:
+            continue
+
+        yield spans[cut-1], [(spans[start][0], spans[end-1][1], term_id) for start, end, term_id in matches]
+        del spans[:cut], stemmed_words[:cut]
+
+    # the words of the last chunk
+    if stemmed_words:
+        matches = lexicon.find_matches(stemmed_words)
+        yield spans[-1], [(spans[start][0], spans[end-1][1], term_id) for start, end, term_id in matches]
+
+def stream_marked_html(text, language='german', chunk_size=5000):
+    """
+    Creates the HTML of the text with the sensitive terms marked segment by segment (see iter_matched_segments), 
+    joined together the segments are the same HTML as create_marked_html creates for the whole text.
+
+    Parameters:
+    - text (str): The text to be analyzed for sensitive terms.
+    - language (str, optional): The language used for stemming. Defaults to 'german'.
+    - chunk_size (int, optional): The minimum number of characters of a chunk. Defaults to 5000.
+
+    Yields:
+    - tuple: The marked HTML and the HTML of the modals of each segment.
+    """
+    position = 0 # end of the text that was already added
+    next_modal_id = 0
+    records = get_lexicon(language).records
+    for (_, segment_end), matches in iter_matched_segments(text, language, chunk_size):
+        # look up the records of the matched terms of the segment in the lexicon
+        marks = [(start, end, records[term_id]) for start, end, term_id in matches if term_id in records]
+
+        marked_html, modals, next_modal_id = render_marks(text, marks, language, position, next_modal_id)
+        position = marks[-1][1] if marks else position
+        # add the rest of the segment up to its last word
+        marked_html.append(text[position:max(position, segment_end)])
+        position = max(position, segment_end)
+        yield "".join(marked_html), modals
 
 @app.route('/rate_alternative', methods=['POST'])
 def rate_alternative():
+    # limit how many ratings a client can send to absorb bursts
+    if not rating_limiter.allow(request.remote_addr):
+        return "Too many ratings, please try again later", 429
+
     # Handle exceptions 
     if not 'original_id' in request.form:
         return "No original_id provided", 400
@@ -332,48 +1022,88 @@ def rate_alternative():
             alternative_id = request.form.get('alternative_id')
             rating = int(request.form.get('rating'))
             
-            if Term.query.get(original_id) is None or Term.query.get(alternative_id) is None:
+            if not is_known_term(original_id) or not is_known_term(alternative_id):
                 return "Not a valid id", 400
 
         except ValueError:
             return "Malformed request parameters provided", 400
         
-        # add rating to database
-        alt_rating = AlternativeRating(term_id=original_id, alternative_term_id=alternative_id, rating=rating)
-        db.session.add(alt_rating)
-        db.session.commit()
+        if write_queue is not None:
+            # the rating is written with the next batch
+            if not write_queue.add_alternative_rating(original_id, alternative_id, rating):
+                return "Too many ratings, please try again later", 503
+        else:
+            # add rating to database
+            add_alternative_rating(original_id, alternative_id, rating)
+            db.session.commit()
+            invalidate_rated_terms((), (original_id,))
 
     return "rate alternative"
 
 @app.route('/report', methods=["POST"])
 def report():
+    # limit how many ratings a client can send to absorb bursts
+    if not rating_limiter.allow(request.remote_addr):
+        return "Too many ratings, please try again later", 429
+
     # Handle exceptions 
     if not 'term_id' in request.form:
         return "No term_id provided", 400
     else:
         try:
             term_id = request.form.get('term_id')
-            if Term.query.get(term_id) is None:
+            if not is_known_term(term_id):
                 return "Not a valid term id", 400
 
         except ValueError:
             return "Malformed request parameters provided", 400
 
-        # create offensiveness rating
-        o_rating = OffensivenessRating(term_id=term_id, rating=1)
-        db.session.add(o_rating)
-        db.session.commit()
+        if write_queue is not None:
+            # the rating is written with the next batch
+            if not write_queue.add_offensiveness_rating(term_id):
+                return "Too many ratings, please try again later", 503
+        else:
+            # create offensiveness rating
+            add_offensiveness_rating(term_id, rating=1)
+            db.session.commit()
+            invalidate_rated_terms((term_id,), ())
     
     return "okay", 200
+
+def is_known_term(term_id):
+    """ Returns whether a term with the given id exists, using the lexicons in memory instead of querying the database. """
+    return any(term_id in get_lexicon(language).term_id_set for language in supported_languages)
+
+def invalidate_rated_terms(reported_ids, rated_ids):
+    """
+    Removes the cached data showing the ratings of the given terms after new ratings were written.
+
+    Parameters:
+    - reported_ids (iterable): The ids of the terms that were marked as offensive.
+    - rated_ids (iterable): The ids of the terms whose alternatives were rated.
+    """
+    for term_id in rated_ids:
+        # the alternatives of the rated term have to be ranked and their popups rendered again with the new average rating
+        invalidate_alternatives(term_id)
+        popup_cache.invalidate(term_id)
+    for term_id in reported_ids:
+        popup_cache.invalidate(term_id)
+    # take the new ratings version at once, so that cached responses showing the old ratings are not used any more. 
+    # The ratings were written by this process, so the other cached ratings stay valid
+    ratings_watcher.acknowledge(pop_written_sync_versions('ratings'))
+    ratings_watcher.check(0)
         
-def create_popup_html(term, language="german", starting_modal_id=0):
+def create_popup_html(term, language="german", starting_modal_id=0, details=None, generation=None):
     """ 
-    Create the HTML of the popup for the given term. 
+    Create the HTML of the popup for the given term. The popup is rendered once and reused from the popup cache until 
+    the term or one of its alternatives is rated.
 
     Arguments:
-        term: term object of the term for which to create the popup. 
+        term: record (or term object) of the term for which to create the popup. 
         language: optional argument specifying the language of the popup, defaults to 'german' (currently only affects the alternative heading as no other parts take internationalization into account). 
         starting_modal_id (int): the starting id used for the rating and offensiveness modals corresponding to the popup of the term, the modals of the alternative terms will use ascending ids.
+        details (dict): optional details of the term, containing its 'alternatives' with their average rating as returned by load_alternatives, they are loaded from the database if needed and not given.
+        generation (int): the generation of the popup cache taken before the given details were loaded (see FragmentCache.generation), required with the details so that popups showing outdated ratings are not cached.
 
     Returns:
         (str) the HTML of the popup as a string
@@ -381,9 +1111,38 @@ def create_popup_html(term, language="german", starting_modal_id=0):
         (int) the next free id (the last modal id + 1). This can be used as the text starting_modal_id. 
 
     """
+    key = (term.id, language, get_terms_version())
+    fragment = popup_cache.get(key)
+    if fragment is None:
+        if details is None:
+            generation = popup_cache.generation()
+            details = {"alternatives": load_alternatives([term.id])[term.id]}
+        popup, modals, modal_count = render_popup_fragment(term, language, details)
+        fragment = (RelocatableFragment(popup), RelocatableFragment(modals), modal_count)
+        # the fragment shows the ratings of the term and its alternatives
+        term_ids = [term.id] + [alternative.id for alternative, _ in details["alternatives"]]
+        popup_cache.put(key, fragment, term_ids, generation)
+
+    popup, modals, modal_count = fragment
+    return popup.render(starting_modal_id), modals.render(starting_modal_id), starting_modal_id + modal_count
+
+def render_popup_fragment(term, language, details):
+    """ 
+    Render the HTML of the popup for the given term with modal ids relative to the first modal of the popup (see create_popup_html). 
+
+    Arguments:
+        term: record (or term object) of the term for which to create the popup. 
+        language: the language of the popup.
+        details (dict): details of the term, containing the alternatives with their average rating as returned by load_alternatives.
+
+    Returns:
+        (str) the HTML of the popup as a string, with placeholders for the modal ids
+        (str) the HTML of all modals as a string, with placeholders for the modal ids
+        (int) the number of modals
+    """
 
     #  HTML as string templates
-    alternative_heading = "Alternative terms" if language=="english" else "Alternative Begriffe"
+    alternative_heading = get_language(language).strings.get("alternative_heading", "Alternative terms")
     popup = "<div class='popuptext'><h3><a href=\"{term_base_url}{term_id}\" class='term-link'>{term_term}</a>{report}</h3><p>{term_description}<p><h4>{alternative_heading}</h4>{alternative_list}</div>"
     alternative_list = "<ol>{list}</ol>"
     list_item = "<li><div class=\"alt-item-div\"><a href=\"{term_base_url}{term_id}\" class='alternative-term-link'>{term_term}</a><div class=\"popup-inline\">{alt_rating}</div><div class=\"popup-inline\">{rate}</div><div class=\"popup-inline\">{report}</div></div></li>"
@@ -429,40 +1188,29 @@ def create_popup_html(term, language="german", starting_modal_id=0):
         </div>"""
 
 
-    # get alternative terms
-    alternatives = AlternativeTerm.query.filter(AlternativeTerm.original_term_id==term.id).all()
-    modal_id = starting_modal_id
+    # get alternative terms with their average ratings, already ordered by their rating
+    alternatives = details["alternatives"]
+    modal_id = 0
     
     
     alternatives_list = []
-    alt_mean_rating_list = []
     all_modals = ""
 
     # for each alteranative term
-    for alt_term in alternatives:
-        # get the term object
-        alternative_term_object = Term.query.get(alt_term.alternative_term_id)
-
-        # get the average rating for the term
-        avg = AlternativeRating.query.filter(AlternativeRating.term_id==term.id, AlternativeRating.alternative_term_id==alternative_term_object.id).with_entities(func.avg(AlternativeRating.rating)).first()
-        
-        # if there are no ratings set the average to the middle value
-        a = avg[0] if avg[0] is not None else 2.5
-        alt_mean_rating_list.append(a)
-
-        alt_rating = "{:.2f}".format(avg[0]) if avg[0] is not None else ""
+    for alternative_term_object, avg in alternatives:
+        alt_rating = "{:.2f}".format(avg) if avg is not None else ""
 
         # get the url for the rate function
         rate_url = url_for('rate_alternative', original_id=term.id, alternative_id=alternative_term_object.id)
         
         # create the report and rating buttons and corresponding modals and add those to the string with all modals
-        report = button_html.format(modal_id=modal_id, button_text="Mark as offensive")
-        modal = offensive_modal_html.format(modal_id=modal_id, term=alternative_term_object.term, term_id=alternative_term_object.id)
+        report = button_html.format(modal_id=modal_id_placeholder(modal_id), button_text="Mark as offensive")
+        modal = offensive_modal_html.format(modal_id=modal_id_placeholder(modal_id), term=alternative_term_object.term, term_id=alternative_term_object.id)
         all_modals = all_modals + modal
         modal_id += 1
 
-        rate = button_html.format(modal_id=modal_id, button_text="Rate")
-        modal = rating_modal_html.format(term_id=term.id, alt_term_id=alternative_term_object.id, modal_id=modal_id, alternative_term=alternative_term_object.term, original_term=term.term)
+        rate = button_html.format(modal_id=modal_id_placeholder(modal_id), button_text="Rate")
+        modal = rating_modal_html.format(term_id=term.id, alt_term_id=alternative_term_object.id, modal_id=modal_id_placeholder(modal_id), alternative_term=alternative_term_object.term, original_term=term.term)
         all_modals = all_modals + modal
         modal_id += 1
 
@@ -471,15 +1219,11 @@ def create_popup_html(term, language="german", starting_modal_id=0):
    
     
     # construct the whole list
-    # sort by rating
-    sorted_indices = np.argsort(np.array(alt_mean_rating_list).flatten())
-    sorted_alternatives = np.array(alternatives_list)[sorted_indices[::-1]]
-    
-    complete_list = ""+alternative_list.format(list="".join(sorted_alternatives))
+    complete_list = ""+alternative_list.format(list="".join(alternatives_list))
 
     # created report button and modal for the term
-    report = button_html.format(modal_id=modal_id, button_text="Mark as offensive")
-    modal = offensive_modal_html.format(modal_id=modal_id, term=term.term, term_id=term.id)
+    report = button_html.format(modal_id=modal_id_placeholder(modal_id), button_text="Mark as offensive")
+    modal = offensive_modal_html.format(modal_id=modal_id_placeholder(modal_id), term=term.term, term_id=term.id)
     all_modals = all_modals + modal
     modal_id += 1
 
@@ -489,5 +1233,50 @@ def create_popup_html(term, language="german", starting_modal_id=0):
     # construct the whole popup and return it
     return popup.format(term_base_url="https://www.machtsprache.de/term/", term_id=term.id,report=report, term_term=term.term, term_description=term.description, alternative_heading=alternative_heading, alternative_list=complete_list), all_modals, modal_id
 
+def warm_up_once():
+    """ Loads the lexicons of all supported languages, the tokenizer data and the language profiles once. """
+    with app.app_context():
+        # remember the versions of the synced terms and ratings, then stem the sensitive terms once instead of for every request
+        refresh_lexicons_if_synced(0)
+        ratings_watcher.check(0)
+        load_lexicons(supported_languages)
+        if term_search_available:
+            # an outdated search index only makes the search miss changed terms, so it doesn't keep the app from being ready
+            try:
+                refresh_search_index()
+            except Exception as e:
+                print(f"Warning: the search index could not be rebuilt, the term search may miss changed terms: {e}")
+    for language in supported_languages:
+        load_sentence_tokenizer(get_language(language).tokenizer_language)
+    language_detector.warm_up()
+
+
+def warm_up():
+    """
+    Loads everything the first requests would otherwise have to load (see warm_up_once), tried up to WARM_UP_ATTEMPTS times 
+    with a growing delay. Sets warmed_up when done, also if the last try failed, since the requests then load what is missing themselves.
+    """
+    attempts = max(app.config['WARM_UP_ATTEMPTS'], 1)
+    for attempt in range(attempts):
+        try:
+            warm_up_once()
+            break
+        except Exception as e:
+            if attempt + 1 == attempts:
+                print(f"Error warming up, giving up after {attempts} tries: {e}")
+                break
+            delay = app.config['WARM_UP_RETRY_DELAY'] * 2 ** attempt
+            print(f"Error warming up, trying again in {delay:.1f}s: {e}")
+            time.sleep(delay)
+    warmed_up.set()
+
+# warm up off the critical path, so workers start quickly
+warm_up_thread = None
+if app.config['WARM_UP_IN_BACKGROUND']:
+    warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    warm_up_thread.start()
+else:
+    warm_up()
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,142 @@
+import os
+import queue
+import threading
+import time
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, add_offensiveness_ratings, add_alternative_ratings
+
+# put into the queue to make the worker write the ratings it holds and stop
+_STOP = object()
+
+
+class RatingWriteQueue(object):
+    """ Collects the ratings and reports of the users and writes them to the database in batches in a background thread """
+
+    def __init__(self, app, batch_size=200, flush_interval=1.0, max_pending=10000, on_flush=None):
+        """
+        Parameters:
+        - app (Flask): The application whose database the ratings are written to.
+        - batch_size (int, optional): The maximum number of ratings written in one transaction. Defaults to 200.
+        - flush_interval (float, optional): The maximum number of seconds a rating waits to be written. Defaults to 1.0.
+        - max_pending (int, optional): The maximum number of ratings waiting to be written, further ratings are rejected. Defaults to 10000.
+        - on_flush (callable, optional): Called after each written batch with the set of reported term ids and the set
+          of term ids whose alternatives were rated, e.g. to invalidate caches. It is called in an application context.
+        """
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._queue = queue.Queue(max_pending)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def add_offensiveness_rating(self, term_id):
+        """ Queues an offensiveness rating of the term, returns False if too many ratings are waiting to be written. """
+        return self._put(("offensiveness", term_id))
+
+    def add_alternative_rating(self, term_id, alternative_term_id, rating):
+        """ Queues a rating of the alternative for the term, returns False if too many ratings are waiting to be written. """
+        return self._put(("alternative", (term_id, alternative_term_id, rating)))
+
+    def _put(self, item):
+        self._start_worker()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            return False
+        return True
+
+    def _start_worker(self):
+        # the worker is started with the first rating, and again in processes forked from this one as threads are not copied
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="rating-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            # wait for the first rating, then collect ratings until the batch is full or the first rating waited long enough
+            batch = []
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch.append(item)
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    # the ratings of the batch were already accepted, so they are written before stopping
+                    stopped = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+    def close(self, timeout=10.0):
+        """
+        Stops the worker after it wrote the batch it is collecting, then writes all ratings still waiting to be written.
+        Registered to run when the process exits, so no accepted rating is lost.
+
+        Parameters:
+        - timeout (float, optional): The maximum number of seconds to wait for the worker. Defaults to 10.
+        """
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            try:
+                # the worker keeps taking ratings out of a full queue, so there is room for the stop signal soon
+                self._queue.put(_STOP, timeout=timeout)
+                thread.join(timeout)
+            except queue.Full:
+                print("Error stopping the rating writer: the queue stayed full")
+        self.flush()
+
+    def flush(self):
+        """ Writes all ratings that are waiting in the queue, e.g. before the process exits (see close). """
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        for start in range(0, len(batch), self.batch_size):
+            self._write(batch[start:start + self.batch_size])
+
+    def _write(self, batch):
+        offensiveness_ratings = [arguments for kind, arguments in batch if kind == "offensiveness"]
+        alternative_ratings = [arguments for kind, arguments in batch if kind == "alternative"]
+
+        with self.app.app_context():
+            try:
+                add_offensiveness_ratings(offensiveness_ratings)
+                add_alternative_ratings(alternative_ratings)
+                db.session.commit()
+            except SQLAlchemyError as e:
+                print(f"Error writing {len(batch)} ratings: {e}")
+                db.session.rollback()
+                self.failed += len(batch)
+                return
+
+            self.written += len(batch)
+            self.batches += 1
+            if self.on_flush is not None:
+                self.on_flush(set(offensiveness_ratings), set(term_id for term_id, _, _ in alternative_ratings))
+
+    def stats(self):
+        """ Returns a dictionary with the number of waiting, written and failed ratings and of written batches. """
+        return {"pending": self._queue.qsize(), "written": self.written, "failed": self.failed, "batches": self.batches}